@@ -0,0 +1,397 @@
+"""Benchmarks for the car's control and camera paths
+
+Run against a server started on the Pi (or off the car with fake_camera.py):
+
+    python3 benchmark.py control-latency ws://<pi-ip>:8765
+
+`suite`, `motor` and `pwm` run locally against the simulated RPi.GPIO
+(sim_gpio.py) and a fake sysfs tree, never the real pins or PWM chip:
+
+    python3 benchmark.py suite [--latency-us 50]
+    python3 benchmark.py motor
+    python3 benchmark.py pwm
+
+`protocol` compares the JSON and binary control protocols: server-side cost
+per joystick message locally, and messages/s against a running server:
+
+    python3 benchmark.py protocol [ws://<pi-ip>:8765]
+
+`startup` starts the server itself on simulated hardware (CAR_SIMULATE=1)
+and times its first accepted connection:
+
+    python3 benchmark.py startup [--profile waveshare]
+"""
+import argparse
+import asyncio
+import collections
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def report(name, samples_ms):
+    print(f"{name}: n={len(samples_ms)} p50={percentile(samples_ms, 50):.1f} ms "
+          f"p99={percentile(samples_ms, 99):.1f} ms max={max(samples_ms):.1f} ms")
+
+
+async def _joystick_rtts(url, count, interval, capture_every):
+    """Send joystick commands and time each reply.
+
+    With capture_every > 0 the same connection also fires a capture every
+    N joystick commands, the worst case for head-of-line blocking.
+    """
+    rtts = []
+    pending = collections.deque()
+
+    async with websockets.connect(url, max_size=None) as ws:
+        async def read_replies():
+            async for message in ws:
+                if isinstance(message, str) and json.loads(message).get('command') == 'joystick':
+                    pending.popleft().set_result(time.perf_counter())
+
+        reader = asyncio.create_task(read_replies())
+        loop = asyncio.get_running_loop()
+        try:
+            for i in range(count):
+                if capture_every and i % capture_every == 0:
+                    await ws.send(json.dumps({'command': 'capture', 'binary': True}))
+                reply = loop.create_future()
+                pending.append(reply)
+                sent = time.perf_counter()
+                await ws.send(json.dumps({'command': 'joystick', 'x': 0.0, 'y': 0.1 if i % 2 else 0.2}))
+                rtts.append((await asyncio.wait_for(reply, 5) - sent) * 1000)
+                await asyncio.sleep(interval)
+            await ws.send(json.dumps({'command': 'stop'}))
+        finally:
+            reader.cancel()
+    return rtts
+
+
+async def _capture_load(url, stop):
+    async with websockets.connect(url, max_size=None) as ws:
+        while not stop.is_set():
+            await ws.send(json.dumps({'command': 'capture', 'binary': True}))
+            await ws.recv()
+
+
+async def control_latency(url, count, interval, capture_clients, capture_every):
+    report("joystick RTT, idle", await _joystick_rtts(url, count, interval, 0))
+
+    stop = asyncio.Event()
+    load = [asyncio.create_task(_capture_load(url, stop)) for _ in range(capture_clients)]
+    try:
+        rtts = await _joystick_rtts(url, count, interval, capture_every)
+    finally:
+        stop.set()
+        await asyncio.gather(*load, return_exceptions=True)
+    report(f"joystick RTT, {capture_clients} capture clients + capture every {capture_every}", rtts)
+
+
+def simulated_motor(latency_us=0.0):
+    """A MotorController on sim_gpio, whatever CAR_SIMULATE says; returns (sim_gpio, motor)."""
+    os.environ['CAR_SIMULATE'] = '1'
+    import sim_gpio
+    from motor_controller import MotorController
+
+    motor = MotorController()
+    sim_gpio.latency = latency_us / 1e6
+    return sim_gpio, motor
+
+
+def measure_commands(name, command, count, transactions, prepare=None):
+    """Time count calls of command(i); prepare(i), if given, runs untimed before each one."""
+    samples = []
+    total = 0
+    for i in range(count):
+        if prepare is not None:
+            prepare(i)
+        before = transactions()
+        started = time.perf_counter()
+        command(i)
+        samples.append(time.perf_counter() - started)
+        total += transactions() - before
+    print(f"{name:<10} {count / sum(samples):>9.0f} cmds/s  {total / count:5.2f} tx/cmd  "
+          f"p50 {percentile(samples, 50) * 1e6:8.1f} us  p99 {percentile(samples, 99) * 1e6:8.1f} us")
+
+
+def joystick_messages(count=200):
+    """A stick held forward and swept left and right, as the app sends it."""
+    return [json.dumps({'command': 'joystick', 'x': round(0.6 * math.sin(i / 20), 3), 'y': 0.8})
+            for i in range(count)]
+
+
+def command_suite(count, latency_us):
+    """Throughput, GPIO calls and latency per command through the simulated GPIO.
+
+    `joystick` is the server's handler work (parse, joystick_to_duty) plus
+    the drive() the control loop makes from it.
+    """
+    gpio, motor = simulated_motor(latency_us)
+    from config import JOYSTICK_DEAD_ZONE
+    from utils import joystick_to_duty
+
+    transactions = lambda: gpio.transactions
+    speeds = [(80, 80), (-60, 40), (30, -90), (60, 60)]
+    messages = joystick_messages()
+
+    def joystick(i):
+        data = json.loads(messages[i % len(messages)])
+        motor.drive(*joystick_to_duty(data.get('x', 0), data.get('y', 0), motor.speed, JOYSTICK_DEAD_ZONE))
+
+    print(f"sim_gpio, {latency_us:g} us per GPIO call, {count} commands each")
+    measure_commands("drive", lambda i: motor.drive(*speeds[i % 4]), count, transactions)
+    measure_commands("stop", lambda i: motor.stop(), count, transactions,
+                     prepare=lambda i: motor.drive(*speeds[i % 4]))
+    measure_commands("joystick", joystick, count, transactions)
+    motor.cleanup()
+
+
+def legacy_drive(gpio, motor, left, right):
+    """drive() as it was before change tracking: four outputs and two duty changes every time."""
+    from config import IN1, IN2, IN3, IN4
+    for in_a, in_b, forward in ((IN1, IN2, left >= 0), (IN3, IN4, right >= 0)):
+        gpio.output(in_a, gpio.HIGH if forward else gpio.LOW)
+        gpio.output(in_b, gpio.LOW if forward else gpio.HIGH)
+    motor.pwm_a.set_duty(abs(left))
+    motor.pwm_b.set_duty(abs(right))
+
+
+def motor_throughput(count):
+    gpio, motor = simulated_motor()
+
+    def run(name, command):
+        calls, outputs, duties = gpio.transactions, gpio.counts['output'], gpio.counts['PWM.ChangeDutyCycle']
+        started = time.perf_counter()
+        for i in range(count):
+            command(i)
+        elapsed = time.perf_counter() - started
+        print(f"{name:<20} {count / elapsed:>9.0f} cmds/s  "
+              f"{(gpio.transactions - calls) / count:.2f} GPIO calls  "
+              f"{(gpio.counts['output'] - outputs) / count:.2f} outputs  "
+              f"{(gpio.counts['PWM.ChangeDutyCycle'] - duties) / count:.2f} duty changes per command")
+
+    # A held stick: same directions, duty wobbling by a percent or two
+    run("drive, legacy", lambda i: legacy_drive(gpio, motor, 70 + i % 3, 70 - i % 2))
+    run("drive, held stick", lambda i: motor.drive(70 + i % 3, 70 - i % 2))
+    run("drive, repeated", lambda i: motor.drive(80, 80))
+    run("drive, reversing", lambda i: motor.drive(60 if i % 2 else -60, -60 if i % 2 else 60))
+    run("stop", lambda i: motor.stop())
+
+
+def fake_pwmchip(root, channels=2):
+    """A /sys/class/pwm/pwmchip0 look-alike with its channels already exported."""
+    chip = os.path.join(root, 'pwmchip0')
+    for channel in range(channels):
+        os.makedirs(os.path.join(chip, f'pwm{channel}'))
+        for name in ('period', 'duty_cycle', 'enable'):
+            with open(os.path.join(chip, f'pwm{channel}', name), 'w') as f:
+                f.write('0')
+    for name in ('export', 'unexport'):
+        open(os.path.join(chip, name), 'w').close()
+
+
+def pwm_backends(count):
+    """Exercise SysfsPWM against a fake pwmchip tree: duty-change cost and the values it writes.
+
+    The CPU RPi.GPIO software PWM burns runs in its own threads between
+    duty changes, so it can only be measured on the Pi (see README).
+    """
+    from pwm import SysfsPWM
+
+    with tempfile.TemporaryDirectory() as root:
+        fake_pwmchip(root)
+        pwm = SysfsPWM(0, 0, 10000, root=root)
+        started = time.perf_counter()
+        for i in range(count):
+            pwm.set_duty(i % 101)
+        elapsed = time.perf_counter() - started
+        print(f"sysfs set_duty: {elapsed / count * 1e6:.2f} us/call")
+
+        # A sysfs attribute takes each write as its whole new value; the fake tree's plain
+        # file keeps any longer earlier value's trailing digits, so empty it first
+        open(os.path.join(pwm.path, 'duty_cycle'), 'w').close()
+        pwm.set_duty(37.5)
+        with open(os.path.join(pwm.path, 'period')) as period, open(os.path.join(pwm.path, 'duty_cycle')) as duty:
+            print(f"fake tree: period={period.read()} ns, duty_cycle={duty.read()} ns after set_duty(37.5)")
+        pwm.close()
+        with open(os.path.join(pwm.path, 'enable')) as enable:
+            print(f"fake tree: enable={enable.read()} after close()")
+
+
+class _Motor:
+    speed = 80
+
+    def set_speed(self, speed):
+        self.speed = speed
+
+
+def _json_joystick(message, control, motor, dead_zone, dumps_twice):
+    """The server's JSON joystick path, minus logging; dumps_twice is how it was before reusing the reply."""
+    from utils import joystick_to_duty
+
+    data = json.loads(message)
+    left, right = joystick_to_duty(data.get('x', 0), data.get('y', 0), motor.speed, dead_zone)
+    control.set(left, right)
+    response = {'status': 'ok', 'command': 'joystick', 'speed': motor.speed,
+                'left_motor': round(left, 1), 'right_motor': round(right, 1)}
+    if dumps_twice:
+        json.dumps(response)
+    return json.dumps(response)
+
+
+def protocol_cost(count):
+    """Server CPU per joystick message for each protocol, no network involved."""
+    from control_loop import ControlLoop
+    from protocol import ACK_ALL, ACK_NONE, JOYSTICK, BinarySession, request
+
+    motor = _Motor()
+    control = ControlLoop(motor)  # never started: set() only stores the setpoint
+    json_messages = joystick_messages()
+    frames = [request(JOYSTICK, i, 0.6 * math.sin(i / 20), 0.8, i) for i in range(len(json_messages))]
+    n = len(frames)
+
+    cases = [
+        ("json, reply dumped twice", lambda i: _json_joystick(json_messages[i % n], control, motor, 0.05, True)),
+        ("json", lambda i: _json_joystick(json_messages[i % n], control, motor, 0.05, False)),
+    ]
+    for ack in (ACK_ALL, ACK_NONE):
+        session = BinarySession(ack, dead_zone=0.05)
+        cases.append((f"binary, ack {ack}", lambda i, session=session: session.handle(frames[i % n], control, motor)))
+
+    for name, handle in cases:
+        started = time.perf_counter()
+        for i in range(count):
+            handle(i)
+        elapsed = time.perf_counter() - started
+        print(f"{name:<26} {count / elapsed:>9.0f} msgs/s  {elapsed / count * 1e6:6.2f} us per message")
+
+
+async def _protocol_throughput(url, mode, count):
+    from protocol import JOYSTICK, request
+
+    async with websockets.connect(url, max_size=None) as ws:
+        if mode != 'json':
+            await ws.send(json.dumps({'command': 'hello', 'protocol': 'binary', 'ack': mode, 'ack_every': 10}))
+            await ws.recv()
+        started = time.perf_counter()
+        for i in range(count):
+            x = round(0.6 * math.sin(i / 20), 3)
+            if mode == 'json':
+                await ws.send(json.dumps({'command': 'joystick', 'x': x, 'y': 0.8}))
+            else:
+                await ws.send(request(JOYSTICK, i, x, 0.8, int(time.monotonic() * 1000)))
+        # Commands are handled in order: the status reply means every joystick message was
+        await ws.send(json.dumps({'command': 'status'}))
+        replies = 0
+        async for reply in ws:
+            if isinstance(reply, str) and json.loads(reply).get('command') == 'status':
+                break
+            replies += 1
+        elapsed = time.perf_counter() - started
+        await ws.send(json.dumps({'command': 'stop'}))
+    print(f"{mode if mode == 'json' else 'binary, ack ' + mode:<26} {count / elapsed:>9.0f} msgs/s  "
+          f"{replies} replies")
+
+
+async def protocol_throughput(url, count):
+    for mode in ('json', 'all', 'batch', 'none'):
+        await _protocol_throughput(url, mode, count)
+
+
+async def _time_startup(directory, env, timeout=30):
+    """Start a server; seconds until its first accepted connection and until its motors are ready."""
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, 'websocket_server.py'], cwd=directory, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if time.perf_counter() - started > timeout or server.poll() is not None:
+                raise RuntimeError("server did not accept a connection")
+            try:
+                ws = await websockets.connect('ws://127.0.0.1:8765', open_timeout=1)
+                break
+            except OSError:
+                await asyncio.sleep(0.005)
+        accepted = time.perf_counter() - started
+        async with ws:
+            while True:
+                await ws.send(json.dumps({'command': 'status'}))
+                status = json.loads(await ws.recv())
+                if status['state'] != 'warming_up':
+                    break
+                await asyncio.sleep(0.01)
+        return accepted, time.perf_counter() - started, status
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def startup(profile, runs):
+    """Time to first accepted connection, cold (no cached diagnostic) and warm."""
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'waveshare_hat' if profile == 'waveshare' else '')
+    with tempfile.TemporaryDirectory() as cache:
+        env = dict(os.environ, CAR_SIMULATE='1', CAR_DIAGNOSTICS_CACHE=os.path.join(cache, 'diagnostics.json'))
+        env.pop('CAR_DIAGNOSE', None)
+        for run in range(runs):
+            accepted, ready, status = await _time_startup(directory, env)
+            cache_state = 'cached' if status['diagnostics_cached'] else 'ran'
+            print(f"run {run + 1}: first connection accepted after {accepted * 1e3:7.1f} ms, "
+                  f"motors {status['state']} after {ready * 1e3:7.1f} ms (diagnostic {cache_state})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='benchmark', required=True)
+
+    latency = commands.add_parser('control-latency', help="joystick round-trip time while captures are in flight")
+    latency.add_argument('url', nargs='?', default='ws://127.0.0.1:8765')
+    latency.add_argument('--count', type=int, default=200, help="joystick commands per phase (default: 200)")
+    latency.add_argument('--interval', type=float, default=0.02, help="seconds between joystick commands")
+    latency.add_argument('--capture-clients', type=int, default=2, help="extra connections capturing nonstop")
+    latency.add_argument('--capture-every', type=int, default=10,
+                         help="also capture on the joystick connection every N commands (0 = never)")
+
+    suite = commands.add_parser('suite', help="cmds/s, GPIO calls and p50/p99 latency for drive, stop and joystick")
+    suite.add_argument('--count', type=int, default=10000, help="commands per case (default: 10000)")
+    suite.add_argument('--latency-us', type=float, default=0.0, help="simulated time per GPIO call (default: 0)")
+
+    motor = commands.add_parser('motor', help="MotorController command throughput against the simulated RPi.GPIO")
+    motor.add_argument('--count', type=int, default=100000, help="commands per case (default: 100000)")
+
+    pwm = commands.add_parser('pwm', help="hardware PWM backend against a fake sysfs tree")
+    pwm.add_argument('--count', type=int, default=100000, help="duty changes (default: 100000)")
+
+    proto = commands.add_parser('protocol', help="JSON vs binary control protocol, locally and against a server")
+    proto.add_argument('url', nargs='?', help="also measure msgs/s against this server, e.g. ws://127.0.0.1:8765")
+    proto.add_argument('--count', type=int, default=5000, help="joystick messages per case (default: 5000)")
+
+    start = commands.add_parser('startup', help="time from launching the server to its first accepted connection")
+    start.add_argument('--profile', choices=('l298n', 'waveshare'), default='l298n')
+    start.add_argument('--runs', type=int, default=3, help="server starts; the first has no cached diagnostic")
+
+    args = parser.parse_args()
+    if args.benchmark == 'control-latency':
+        asyncio.run(control_latency(args.url, args.count, args.interval, args.capture_clients, args.capture_every))
+    elif args.benchmark == 'suite':
+        command_suite(args.count, args.latency_us)
+    elif args.benchmark == 'motor':
+        motor_throughput(args.count)
+    elif args.benchmark == 'pwm':
+        pwm_backends(args.count)
+    elif args.benchmark == 'protocol':
+        protocol_cost(args.count * 20)
+        if args.url:
+            asyncio.run(protocol_throughput(args.url, args.count))
+    elif args.benchmark == 'startup':
+        asyncio.run(startup(args.profile, args.runs))
@@ -1,9 +1,19 @@
 """Camera module for Raspberry Pi Camera Module 2"""
+import asyncio
+import atexit
+import functools
 import subprocess
 import base64
-import tempfile
 import os
 import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import variants
+from mjpeg import READ_SIZE, FrameExtractor
+from utils import LatencyStats
 
 log = logging.getLogger(__name__)
 
@@ -12,10 +22,599 @@ DEFAULT_WIDTH = 640
 DEFAULT_HEIGHT = 480
 DEFAULT_QUALITY = 80
 
+# Camera executable — point RPICAM_VID at a stand-in (see fake_camera.py) to run without a camera
+RPICAM_VID = os.environ.get('RPICAM_VID', 'rpicam-vid')
 
-def capture_image(width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, quality=DEFAULT_QUALITY):
+# Persistent capture session
+CAPTURE_FRAMERATE = 10      # frames/s kept flowing while the session is open
+CAPTURE_WARMUP_FRAMES = 5   # frames skipped after start-up while exposure settles
+CAPTURE_IDLE_TIMEOUT = 30   # seconds without a capture before the camera is released
+CAPTURE_TIMEOUT = 10        # seconds to wait for a frame
+CAPTURE_WORKERS = 2         # threads running captures for asyncio callers
+CAPTURE_CACHE_TTL = 0.2     # seconds an identical capture request reuses the previous image
+CAPTURE_CACHE_SIZE = 4      # distinct width/height/quality results kept
+
+# Video stream shared by everything in the process that wants live frames, see video_broadcaster()
+VIDEO_WIDTH = 640
+VIDEO_HEIGHT = 480
+VIDEO_FRAMERATE = 15
+VIDEO_QUALITY = DEFAULT_QUALITY
+
+
+class CameraError(Exception):
+    pass
+
+
+class Frame:
+    """One JPEG from the camera plus the times it passed through the reader.
+
+    `timestamp` is wall-clock time when the frame was read (sent to viewers
+    so they can measure glass-to-glass latency); `read_at` and `parsed_at`
+    are time.monotonic() values for per-stage timing.
+    """
+
+    __slots__ = ('data', 'timestamp', 'read_at', 'parsed_at')
+
+    def __init__(self, data, timestamp, read_at, parsed_at):
+        self.data = data
+        self.timestamp = timestamp
+        self.read_at = read_at
+        self.parsed_at = parsed_at
+
+
+class LatestFrameSlot:
+    """Single-slot mailbox holding only the newest frame for one consumer.
+
+    The producer never waits on a consumer: if the previous frame has not
+    been taken yet it is overwritten (and counted in `dropped`), so a slow
+    viewer skips frames instead of holding up everybody else.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame = None
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, frame):
+        with self._cond:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Return the newest frame, or None on timeout / once the slot is closed."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._frame is not None or self.closed, timeout)
+            frame, self._frame = self._frame, None
+            return frame
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class FrameBroadcaster:
+    """One shared rpicam-vid MJPEG process fanned out to any number of consumers.
+
+    The camera is started when the first consumer subscribes and stopped when
+    the last one unsubscribes, so CPU use and camera ownership stay the same
+    no matter how many viewers are connected. Consumers receive Frame objects;
+    `stats` collects per-stage latencies (read and parse here, queue and
+    write recorded by whoever sends the frames on).
+    """
+
+    slot_factory = LatestFrameSlot
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self._lock = threading.Lock()
+        self._slots = set()
+        self._listeners = ()
+        self._targets = ()  # immutable snapshot of slots + listeners read by the reader thread
+        self._process = None
+        self.error = None
+        self.stats = LatencyStats(('read', 'parse', 'queue', 'write'))
+
+    def subscribe(self, slot=None):
+        """Register a consumer and start the camera if it is the first one.
+
+        Any object with put(frame) and close() can be passed as the slot;
+        by default a new `slot_factory()` (a LatestFrameSlot) is created.
+        """
+        if slot is None:
+            slot = self.slot_factory()
+        with self._lock:
+            self._slots.add(slot)
+            self._retarget()
+            if self._process is None:
+                self._start()
+        return slot
+
+    def unsubscribe(self, slot):
+        with self._lock:
+            self._slots.discard(slot)
+            self._retarget()
+            if not self._slots:
+                self._stop()
+        slot.close()
+
+    @property
+    def viewers(self):
+        return len(self._slots)
+
+    def add_listener(self, listener):
+        """Also pass frames to listener.put() while the camera runs, without keeping it running."""
+        with self._lock:
+            self._listeners += (listener,)
+            self._retarget()
+
+    def remove_listener(self, listener):
+        with self._lock:
+            self._listeners = tuple(l for l in self._listeners if l is not listener)
+            self._retarget()
+
+    def close(self):
+        with self._lock:
+            slots, self._slots = self._slots, set()
+            self._retarget()
+            self._stop()
+        for slot in slots:
+            slot.close()
+
+    def _retarget(self):
+        self._targets = tuple(self._slots) + self._listeners
+
+    def _start(self):
+        log.info("Starting camera: %s", ' '.join(self.cmd))
+        self.error = None
+        try:
+            # stderr is discarded: rpicam-vid logs every frame and an unread
+            # pipe would eventually stall the camera process.
+            process = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except FileNotFoundError:
+            self.error = f'{self.cmd[0]} not found'
+            log.error("%s", self.error)
+            for slot in self._slots:
+                slot.close()
+            self._slots = set()
+            self._retarget()
+            return
+        self._process = process
+        threading.Thread(target=self._read_frames, args=(process,), daemon=True).start()
+
+    def _stop(self):
+        process, self._process = self._process, None
+        if process is not None:
+            process.terminate()
+            process.wait()
+            log.info("Camera stopped")
+
+    def _read_frames(self, process):
+        self._publish(process.stdout)
+
+        with self._lock:
+            if self._process is not process:
+                return  # stopped on purpose
+            self.error = f'camera process exited (code {process.wait()})'
+            log.error("Camera process exited unexpectedly: %s", self.error)
+            self._process = None
+            slots, self._slots = self._slots, set()
+            self._retarget()
+        for slot in slots:
+            slot.close()
+
+    def _publish(self, stdout):
+        """Split the camera output into Frames and hand each to every target until EOF."""
+        extractor = FrameExtractor()
+        read = stdout.read1
+        record = self.stats.record
+        frame_started = None  # when the first chunk of the frame in progress arrived
+
+        while True:
+            chunk = read(READ_SIZE)
+            read_at = time.monotonic()
+            if not chunk:
+                break
+            if frame_started is None:
+                frame_started = read_at
+
+            completed = extractor.feed(chunk)
+            if not completed:
+                continue
+            parsed_at = time.monotonic()
+            timestamp = time.time()
+            record('read', read_at - frame_started)
+            record('parse', parsed_at - read_at)
+            frame_started = read_at if extractor.pending else None
+
+            for data in completed:
+                frame = Frame(data, timestamp, read_at, parsed_at)
+                for slot in self._targets:
+                    slot.put(frame)
+
+
+class AsyncFrameSlot:
+    """LatestFrameSlot for a consumer on an asyncio event loop.
+
+    put() and close() may be called from any thread; the frame is handed to
+    the loop, where get() is awaited. As with LatestFrameSlot, a frame not
+    taken before the next one arrives is dropped.
+    """
+
+    def __init__(self, loop=None):
+        self._loop = loop or asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+        self._frame = None
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, frame):
+        try:
+            self._loop.call_soon_threadsafe(self._deliver, frame)
+        except RuntimeError:
+            pass  # the loop has been closed: nobody is left to read the frame
+
+    def close(self):
+        try:
+            self._loop.call_soon_threadsafe(self._close)
+        except RuntimeError:
+            pass
+
+    async def get(self):
+        """Return the newest frame, or None once the slot is closed."""
+        await self._ready.wait()
+        self._ready.clear()
+        frame, self._frame = self._frame, None
+        return frame
+
+    def _deliver(self, frame):
+        if self.closed:
+            return
+        if self._frame is not None:
+            self.dropped += 1
+        self._frame = frame
+        self._ready.set()
+
+    def _close(self):
+        self.closed = True
+        self._ready.set()
+
+
+class LatestFrame:
+    """Broadcaster subscriber that keeps the newest frame readable by any number of callers.
+
+    Unlike LatestFrameSlot, reading does not consume the frame; callers wait
+    on the frame sequence number instead.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.frame = None
+        self.seq = 0
+        self.closed = False
+
+    def put(self, frame):
+        with self._cond:
+            self.frame = frame
+            self.seq += 1
+            self._cond.notify_all()
+
+    def wait(self, after_seq, timeout=None):
+        """Return the newest frame once one newer than after_seq exists, else None."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq > after_seq or self.closed, timeout)
+            return self.frame if self.seq > after_seq else None
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+def still_command(width, height, quality, framerate=CAPTURE_FRAMERATE):
+    return [
+        RPICAM_VID,
+        '-t', '0',
+        '--width', str(width),
+        '--height', str(height),
+        '--framerate', str(framerate),
+        '--codec', 'mjpeg',
+        '--quality', str(quality),
+        '--nopreview',
+        '-o', '-',
+    ]
+
+
+def _fits(width, height, source_width, source_height):
+    """Whether a width x height image can be scaled down from source_width x source_height without distortion."""
+    return (width <= source_width and height <= source_height
+            and abs(width * source_height - height * source_width) <= 0.01 * source_width * source_height)
+
+
+class CaptureSession:
+    """Long-lived camera session for still captures.
+
+    Keeps one rpicam-vid running at the requested size and JPEG quality so a
+    capture returns the newest frame (or waits one frame interval for a
+    fresh one) instead of paying process start-up and sensor warm-up each
+    time. Asking for different settings restarts the camera, once captures
+    still waiting for a frame at the old settings have their frame; the
+    camera is released after `idle_timeout` seconds without captures.
+
+    After share(), captures taken while that FrameBroadcaster has video
+    subscribers (see subscribe_video) use its frames instead of a camera of
+    their own; with no one watching they go back to a camera process at the
+    requested settings.
+    """
+
+    def __init__(self, idle_timeout=CAPTURE_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._settled = threading.Condition(self._lock)  # notified whenever a capture stops waiting for a frame
+        self._active = 0  # captures waiting for a frame from the current camera process
+        self._params = None
+        self._broadcaster = None
+        self._latest = None
+        self._idle_timer = None
+        self._idle_deadline = 0.0
+        self._warmup = CAPTURE_WARMUP_FRAMES
+        self._source = None  # shared broadcaster set by share()
+        self._source_params = None
+        self._pending = []  # video slots waiting for in-flight captures to free the camera
+        # (params, latest, shared) as of the last _open() or _release(), swapped whole for status()
+        self._published = (None, None, False)
+
+    def share(self, broadcaster, width, height, quality):
+        """Take captures from broadcaster (e.g. the video stream's) rather than a camera process of its own.
+
+        broadcaster must produce width x height JPEGs at quality. While it
+        has subscribers of its own, captures use its frames: smaller
+        captures of the same aspect ratio, or at another quality, are
+        re-encoded from its frames if Pillow is installed and returned as
+        they are otherwise; larger or differently shaped ones raise
+        CameraError, as scaling a stream frame up would only pass it off as
+        a full-resolution still. The session subscribes like any other
+        consumer, so the camera keeps running while captures come in and
+        one camera process serves both.
+        """
+        with self._lock:
+            self._source, self._source_params = broadcaster, (width, height, quality)
+
+    def subscribe_video(self, slot):
+        """Subscribe slot to the shared broadcaster, first freeing the camera if the session holds it.
+
+        Does not wait for captures: while some still wait on the session's
+        own camera, slot is subscribed once the last of them has its frame.
+        It does take the session lock and may stop and start camera
+        processes, so event-loop code uses subscribe_video_async().
+        """
+        with self._lock:
+            self._pending.append(slot)
+            if not self._active:
+                self._attach_pending()
+        return slot
+
+    def unsubscribe_video(self, slot):
+        with self._lock:
+            if slot in self._pending:
+                self._pending.remove(slot)
+                slot.close()
+                return
+        self._source.unsubscribe(slot)
+
+    def capture(self, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, quality=DEFAULT_QUALITY,
+                fresh=False, timeout=CAPTURE_TIMEOUT):
+        """Return (jpeg, width, height): JPEG bytes at the given settings, and their actual size.
+
+        With fresh=True the frame is guaranteed to have been taken after
+        the call started. Raises CameraError or TimeoutError.
+        """
+        params = (width, height, quality)
+        with self._settled:
+            while True:
+                shared = self._streaming()
+                if shared and not _fits(width, height, *self._source_params[:2]):
+                    raise CameraError("camera is streaming at {}x{}; stills must be no larger and the same shape".format(
+                        *self._source_params[:2]))
+                if not (self._latest is None or self._latest.closed
+                        or (self._broadcaster is self._source) != shared
+                        or (not shared and self._params != params)):
+                    break
+                # Restarting the camera would fail captures still waiting on it
+                if not self._active:
+                    self._open(params, shared)
+                    break
+                self._settled.wait()
+            broadcaster, latest = self._broadcaster, self._latest
+            source_params = self._source_params if broadcaster is self._source else None
+            after = self._warmup - 1
+            self._active += 1
+            self._arm_idle_timer()
+
+        if fresh:
+            after = max(after, latest.seq)
+        try:
+            frame = latest.wait(after, timeout)
+        finally:
+            with self._settled:
+                self._active -= 1
+                if not self._active:
+                    self._attach_pending()
+                self._settled.notify_all()
+        if frame is None:
+            if latest.closed:
+                raise CameraError(broadcaster.error or 'camera stopped')
+            raise TimeoutError('capture timed out')
+        if source_params is None or params == source_params:
+            return frame.data, width, height
+        if variants.Image is None:
+            return (frame.data, *source_params[:2])
+        return variants.reencode(frame.data, width, height, quality), width, height
+
+    def status(self):
+        """Camera settings and frame count; never takes the lock, so it is safe on an event loop."""
+        params, latest, shared = self._published
+        if params is None:
+            return {'open': False}
+        width, height, quality = params
+        return {'open': True, 'width': width, 'height': height, 'quality': quality, 'frames': latest.seq,
+                'shared': shared}
+
+    def close(self):
+        with self._lock:
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+                self._idle_timer = None
+            self._release()
+
+    def _streaming(self):
+        """Whether the shared broadcaster has video subscribers (besides this session's own)."""
+        if self._source is None:
+            return False
+        own = 1 if self._latest is not None and self._broadcaster is self._source else 0
+        return bool(self._pending) or self._source.viewers > own
+
+    def _attach_pending(self):
+        if not self._pending:
+            return
+        if self._broadcaster is not self._source:
+            self._release()  # the stream's camera process needs the camera
+        for slot in self._pending:
+            self._source.subscribe(slot)
+        self._pending.clear()
+
+    def _open(self, params, shared=False):
+        self._release()
+        if not shared:
+            self._params = params
+            self._broadcaster = FrameBroadcaster(still_command(*params))
+            self._warmup = CAPTURE_WARMUP_FRAMES
+        else:
+            self._params = self._source_params
+            self._broadcaster = self._source
+            # Frames already flowing to someone else have been through warm-up
+            self._warmup = 1 if self._source.viewers else CAPTURE_WARMUP_FRAMES
+        self._latest = LatestFrame()
+        self._broadcaster.subscribe(self._latest)
+        self._published = (self._params, self._latest, shared)
+
+    def _release(self):
+        if self._broadcaster is not None and self._broadcaster is self._source:
+            self._source.unsubscribe(self._latest)
+        elif self._broadcaster is not None:
+            log.info("Releasing capture session %dx%d q=%d", *self._params)
+            self._broadcaster.close()
+        self._params = self._broadcaster = self._latest = None
+        self._published = (None, None, False)
+
+    def _arm_idle_timer(self):
+        self._idle_deadline = time.monotonic() + self.idle_timeout
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+        self._idle_timer = threading.Timer(self.idle_timeout, self._on_idle)
+        self._idle_timer.daemon = True
+        self._idle_timer.start()
+
+    def _on_idle(self):
+        with self._lock:
+            if time.monotonic() < self._idle_deadline:
+                return  # a capture re-armed the timer while this one was firing
+            self._idle_timer = None
+            self._release()
+
+
+class CaptureCache:
+    """Single-flight capture coalescing plus a short-lived result cache.
+
+    Concurrent requests for the same key share one capture; a successful
+    result is then reused by identical requests for `ttl` seconds. At most
+    `max_entries` results are kept, least recently used evicted first.
+    Failures are shared with the requests that were waiting but never cached.
+    """
+
+    def __init__(self, ttl=CAPTURE_CACHE_TTL, max_entries=CAPTURE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, result)
+        self._inflight = {}            # key -> Future shared by coalesced callers
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key, produce):
+        """Return the cached result for key, or produce() it exactly once."""
+        with self._lock:
+            now = time.monotonic()
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[1]
+
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                self.misses += 1
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = produce()
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            self._store(key, result)
+        future.set_result(result)
+        return result
+
+    def _store(self, key, result):
+        now = time.monotonic()
+        for stale in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+            del self._entries[stale]
+        self._entries[key] = (now + self.ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'entries': len(self._entries),
+            }
+
+
+_session = CaptureSession()
+atexit.register(_session.close)
+
+_cache = CaptureCache()
+
+_executor = ThreadPoolExecutor(max_workers=CAPTURE_WORKERS, thread_name_prefix='capture')
+
+_video = None
+_video_lock = threading.Lock()
+
+
+def capture_jpeg(width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, quality=DEFAULT_QUALITY):
     """
-    Capture a single image using rpicam-still.
+    Capture a single JPEG from the shared capture session.
+
+    The image comes straight from the camera process's stdout — no temp
+    file and no encoding step.
 
     Args:
         width: Image width in pixels
@@ -23,51 +622,106 @@ def capture_image(width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, quality=DEFAULT_QU
         quality: JPEG quality (0-100)
 
     Returns:
-        dict with 'success' bool and either 'data' (base64 image) or 'error' message
+        dict with 'success' bool and either 'jpeg' (raw bytes) with its actual
+        'width' and 'height', or 'error' message
     """
-    with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp:
-        tmp_path = tmp.name
-
     try:
-        cmd = [
-            'rpicam-still',
-            '-o', tmp_path,
-            '--width', str(width),
-            '--height', str(height),
-            '--quality', str(quality),
-            '--nopreview',
-            '--timeout', '1000',  # 1 second timeout for camera to initialize
-        ]
-
-        log.info("Capturing image: %s", ' '.join(cmd))
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-
-        if result.returncode != 0:
-            log.error("rpicam-still failed: %s", result.stderr)
-            return {'success': False, 'error': result.stderr or 'capture failed'}
-
-        with open(tmp_path, 'rb') as f:
-            image_data = f.read()
-
-        encoded = base64.b64encode(image_data).decode('utf-8')
-        log.info("Image captured: %d bytes, base64 length: %d", len(image_data), len(encoded))
+        started = time.monotonic()
+        image_data, width, height = _cache.get(
+            (width, height, quality),
+            lambda: _session.capture(width=width, height=height, quality=quality))
+        log.info("Image captured in %.0f ms: %d bytes", (time.monotonic() - started) * 1000, len(image_data))
 
         return {
             'success': True,
-            'data': encoded,
+            'jpeg': image_data,
             'width': width,
             'height': height,
         }
 
-    except subprocess.TimeoutExpired:
+    except TimeoutError:
         log.error("Camera capture timed out")
         return {'success': False, 'error': 'capture timed out'}
-    except FileNotFoundError:
-        log.error("rpicam-still not found")
-        return {'success': False, 'error': 'rpicam-still not found'}
+    except CameraError as e:
+        log.error("Capture failed: %s", e)
+        return {'success': False, 'error': str(e)}
     except Exception as e:
         log.error("Capture error: %s", e)
         return {'success': False, 'error': str(e)}
-    finally:
-        if os.path.exists(tmp_path):
-            os.unlink(tmp_path)
+
+
+def video_broadcaster():
+    """The process's live video stream, created on first use.
+
+    Subscribe to it with subscribe_video(), not directly: while it has
+    subscribers, captures are taken from its frames too, so video and
+    stills never compete for the camera. The camera runs while the stream
+    has consumers.
+    """
+    global _video
+    with _video_lock:
+        if _video is None:
+            _video = FrameBroadcaster(still_command(VIDEO_WIDTH, VIDEO_HEIGHT, VIDEO_QUALITY, VIDEO_FRAMERATE))
+            atexit.register(_video.close)
+            _session.share(_video, VIDEO_WIDTH, VIDEO_HEIGHT, VIDEO_QUALITY)
+        return _video
+
+
+def subscribe_video(slot):
+    """Subscribe slot to video_broadcaster(), freeing the camera from the capture session first."""
+    video_broadcaster()
+    return _session.subscribe_video(slot)
+
+
+def unsubscribe_video(slot):
+    _session.unsubscribe_video(slot)
+
+
+async def subscribe_video_async(slot):
+    """subscribe_video run on the capture worker pool, for callers on an asyncio event loop.
+
+    It can wait for a capture holding the session lock, and for camera
+    processes to stop and start, none of which may hold up motor commands.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, subscribe_video, slot)
+
+
+def unsubscribe_video_soon(slot):
+    """Queue unsubscribe_video(slot) on the capture worker pool and return at once; safe on an event loop."""
+    _executor.submit(unsubscribe_video, slot)
+
+
+def capture_stats():
+    """Hit/miss/coalesced counters of the capture cache."""
+    return _cache.stats()
+
+
+def camera_status():
+    """Whether the capture session holds the camera (and at what settings), plus the cache counters."""
+    return {**_session.status(), **_cache.stats()}
+
+
+def capture_image(width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, quality=DEFAULT_QUALITY):
+    """
+    Capture a single image as base64, for JSON clients.
+
+    Args:
+        width: Image width in pixels
+        height: Image height in pixels
+        quality: JPEG quality (0-100)
+
+    Returns:
+        dict with 'success' bool and either 'data' (base64 image) or 'error' message
+    """
+    result = capture_jpeg(width=width, height=height, quality=quality)
+    if result['success']:
+        result['data'] = base64.b64encode(result.pop('jpeg')).decode('ascii')
+    return result
+
+
+async def capture_jpeg_async(width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, quality=DEFAULT_QUALITY):
+    """capture_jpeg run on the capture worker pool, for callers on an asyncio event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor, functools.partial(capture_jpeg, width=width, height=height, quality=quality))
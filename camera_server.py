@@ -1,19 +1,28 @@
-"""MJPEG HTTP streaming server for Raspberry Pi Camera Module 2"""
-import subprocess
+"""MJPEG (and H.264) HTTP streaming server for Raspberry Pi Camera Module 2"""
+import json
 import logging
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from threading import Thread
+import math
+import os
+import socket
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Lock, Thread
 import signal
 import sys
+from html import escape
+from urllib.parse import parse_qs, urlsplit
 
-# Track active camera processes for cleanup
-active_processes = set()
+from websockets.protocol import State
+from websockets.server import ServerProtocol
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    datefmt="%H:%M:%S",
-)
+from camera import FrameBroadcaster, RPICAM_VID
+from h264 import H264Broadcaster
+from mjpeg import AdaptivePacer, queued_bytes, send_part, timestamp_headers
+from recorder import SegmentRecorder, replay_frames
+from utils import set_log_level, setup_logging
+from variants import StreamProfile, VariantCache
+
+setup_logging()
 log = logging.getLogger(__name__)
 
 # Stream settings
@@ -21,13 +30,159 @@ STREAM_WIDTH = 640
 STREAM_HEIGHT = 480
 STREAM_FRAMERATE = 15
 STREAM_PORT = 8080
+STREAM_H264_BITRATE = 1000000   # bits/s
+STREAM_H264_INTRA = 15          # frames between keyframes; a new viewer waits at most this long
+
+# Recording — set RECORD_DIR to keep segmented recordings of whatever is streamed
+RECORD_DIR = os.environ.get('RECORD_DIR')
+
+# One camera process shared by every /stream viewer
+broadcaster = FrameBroadcaster([
+    RPICAM_VID,
+    '-t', '0',
+    '--width', str(STREAM_WIDTH),
+    '--height', str(STREAM_HEIGHT),
+    '--framerate', str(STREAM_FRAMERATE),
+    '--codec', 'mjpeg',
+    '--nopreview',
+    '-o', '-',
+])
+
+# H.264 alternative, selected per viewer with /stream?codec=h264. The camera
+# can only be opened by one process, so the two codecs cannot stream at once.
+h264_broadcaster = H264Broadcaster([
+    RPICAM_VID,
+    '-t', '0',
+    '--width', str(STREAM_WIDTH),
+    '--height', str(STREAM_HEIGHT),
+    '--framerate', str(STREAM_FRAMERATE),
+    '--codec', 'h264',
+    '--profile', 'baseline',
+    '--bitrate', str(STREAM_H264_BITRATE),
+    '--intra', str(STREAM_H264_INTRA),
+    '--inline',
+    '--flush',
+    '--nopreview',
+    '-o', '-',
+])
+# Held from checking the other codec's viewers until subscribed, so two requests cannot start both
+_codec_lock = Lock()
+
+# Downscaled / re-compressed frames shared by viewers asking for the same profile
+variants = VariantCache()
+
+# Per-stage frame latencies (read, parse, queue, write), served at /stats
+stats = broadcaster.stats
+
+recorder = None
+
+# jmuxer for the H.264 viewer page, served from here as the car's network has no internet access
+JMUXER_JS = os.environ.get('JMUXER_JS', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jmuxer.min.js'))
+
+# Browsers cannot play raw H.264, so the viewer page remuxes it to fragmented MP4 with jmuxer
+H264_PAGE = '''<!DOCTYPE html>
+<html>
+<head><title>Pi Camera Stream (H.264)</title></head>
+<body style="margin:0;background:#000;display:flex;justify-content:center;align-items:center;height:100vh;">
+    <video id="video" autoplay muted playsinline style="max-width:100%%;max-height:100%%;"></video>
+    <script src="/jmuxer.min.js"></script>
+    <script>
+        const jmuxer = new JMuxer({node: 'video', mode: 'video', flushingTime: 0, fps: %d});
+        const ws = new WebSocket(`ws://${location.host}/stream?codec=h264`);
+        ws.binaryType = 'arraybuffer';
+        ws.onmessage = (event) => jmuxer.feed({video: new Uint8Array(event.data)});
+    </script>
+</body>
+</html>''' % STREAM_FRAMERATE
+
+
+class WebSocketSender:
+    """Send-only WebSocket on a connection whose upgrade request http.server has already read.
+
+    websockets' Sans-I/O protocol does the handshake and the framing. A
+    reader thread feeds it whatever the client sends, so pings get their
+    pong and a close frame or hang-up ends the connection (`open` turns
+    False and send() raises ConnectionResetError).
+    """
+
+    def __init__(self, sock, request):
+        self.sock = sock
+        self._lock = Lock()
+        self.protocol = ServerProtocol()
+        self.protocol.receive_data(request)
+
+    def accept(self):
+        """Answer the upgrade request; False if it was rejected (the error response has been sent)."""
+        with self._lock:
+            events = self.protocol.events_received()
+            if not events:
+                return False  # not a parseable request
+            response = self.protocol.accept(events[0])
+            self.protocol.send_response(response)
+            self._flush()
+        if response.status_code != 101:
+            return False
+        Thread(target=self._read, daemon=True).start()
+        return True
+
+    @property
+    def open(self):
+        return self.protocol.state is State.OPEN
+
+    def send(self, data):
+        with self._lock:
+            if not self.open:
+                raise ConnectionResetError("WebSocket closed")
+            self.protocol.send_binary(data)
+            self._flush()
+
+    def _flush(self):
+        for data in self.protocol.data_to_send():
+            if data:
+                self.sock.sendall(data)
+            else:
+                self.sock.shutdown(socket.SHUT_WR)
+
+    def _read(self):
+        while True:
+            try:
+                data = self.sock.recv(4096)
+            except OSError:
+                data = b''
+            with self._lock:
+                if data:
+                    self.protocol.receive_data(data)
+                else:
+                    self.protocol.receive_eof()
+                self.protocol.events_received()  # nothing to do with them: the protocol answers pings and closes
+                try:
+                    self._flush()
+                except OSError:
+                    pass
+                if not self.open:
+                    return
+
+
+def claim_camera(wanted, other):
+    """Subscribe to the wanted broadcaster unless the other one is streaming; returns the slot, or None."""
+    with _codec_lock:
+        if other.viewers:
+            return None
+        return wanted.subscribe()
 
 
 class MJPEGHandler(BaseHTTPRequestHandler):
     """HTTP handler that serves MJPEG stream"""
 
     def do_GET(self):
-        if self.path == '/':
+        url = urlsplit(self.path)
+        if url.path == '/' and self.codec(parse_qs(url.query)) == 'h264':
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.end_headers()
+            self.wfile.write(H264_PAGE.encode())
+
+        elif url.path == '/':
             self.send_response(200)
             self.send_header('Content-Type', 'text/html')
             self.end_headers()
@@ -35,88 +190,239 @@ class MJPEGHandler(BaseHTTPRequestHandler):
 <html>
 <head><title>Pi Camera Stream</title></head>
 <body style="margin:0;background:#000;display:flex;justify-content:center;align-items:center;height:100vh;">
-    <img src="/stream" style="max-width:100%;max-height:100%;">
+    <img src="/stream{'?' + escape(url.query) if url.query else ''}" style="max-width:100%;max-height:100%;">
 </body>
 </html>'''
             self.wfile.write(html.encode())
 
-        elif self.path == '/stream':
+        elif url.path == '/jmuxer.min.js':
+            try:
+                with open(JMUXER_JS, 'rb') as f:
+                    body = f.read()
+            except FileNotFoundError:
+                log.error("%s not found; the H.264 viewer page needs it (see README)", JMUXER_JS)
+                self.send_error(404, "jmuxer.min.js is not installed on the car")
+                return
             self.send_response(200)
-            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
-            self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
-            self.send_header('Pragma', 'no-cache')
-            self.send_header('Expires', '0')
+            self.send_header('Content-Type', 'text/javascript')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'max-age=86400')
             self.end_headers()
+            self.wfile.write(body)
 
-            cmd = [
-                'rpicam-vid',
-                '-t', '0',
-                '--width', str(STREAM_WIDTH),
-                '--height', str(STREAM_HEIGHT),
-                '--framerate', str(STREAM_FRAMERATE),
-                '--codec', 'mjpeg',
-                '--nopreview',
-                '-o', '-',
-            ]
-
-            log.info("Starting camera: %s", ' '.join(cmd))
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            active_processes.add(process)
+        elif url.path == '/stream' and self.codec(parse_qs(url.query)) == 'h264':
+            self.stream_h264()
 
+        elif url.path == '/stream':
             try:
-                buffer = b''
-                while True:
-                    chunk = process.stdout.read(4096)
-                    if not chunk:
-                        break
-
-                    buffer += chunk
-
-                    # Find JPEG boundaries (FFD8 = start, FFD9 = end)
-                    while True:
-                        start = buffer.find(b'\xff\xd8')
-                        end = buffer.find(b'\xff\xd9')
-
-                        if start != -1 and end != -1 and end > start:
-                            # Extract complete JPEG frame
-                            frame = buffer[start:end + 2]
-                            buffer = buffer[end + 2:]
-
-                            # Send as multipart chunk
-                            self.wfile.write(b'--frame\r\n')
-                            self.wfile.write(b'Content-Type: image/jpeg\r\n')
-                            self.wfile.write(f'Content-Length: {len(frame)}\r\n'.encode())
-                            self.wfile.write(b'\r\n')
-                            self.wfile.write(frame)
-                            self.wfile.write(b'\r\n')
-                        else:
-                            break
+                profile = self.stream_profile(parse_qs(url.query))
+            except ValueError:
+                self.send_error(400, "fps, width and quality must be numbers")
+                return
+            slot = claim_camera(broadcaster, h264_broadcaster)
+            if slot is None:
+                self.send_error(503, "Camera is busy streaming H.264")
+                return
+
+            pacer = AdaptivePacer(profile.fps)
+            variants.acquire(profile)
+            log.info("Viewer connected: %s (%s)", self.address_string(), profile)
+
+            try:
+                self.send_response(200)
+                self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+                self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+                self.send_header('Pragma', 'no-cache')
+                self.send_header('Expires', '0')
+                self.end_headers()
+
+                while not slot.closed:
+                    frame = slot.get(timeout=1.0)
+                    if frame is None:
+                        continue
+
+                    # Behind on this viewer's pace: let the slot keep overwriting,
+                    # then send whatever is newest once the next frame is due
+                    delay = pacer.wait_time(time.monotonic())
+                    if delay > 0:
+                        time.sleep(delay)
+                        frame = slot.get(timeout=0) or frame
+
+                    fps = pacer.fps
+                    pacer.update(queued_bytes(self.connection), time.monotonic())
+                    if pacer.fps < fps - 0.5 or pacer.fps == pacer.max_fps > fps:
+                        log.info("Viewer %s pace %.1f fps (queued %d B, drain %.0f kB/s)",
+                                 self.address_string(), pacer.fps, pacer.queued, (pacer.drain_rate or 0) / 1000)
+
+                    data = variants.get(frame.data, profile)
+                    sending_at = time.monotonic()
+                    stats.record('queue', sending_at - frame.parsed_at)
+                    send_part(self.connection, data, extra=timestamp_headers(frame.timestamp))
+                    sent_at = time.monotonic()
+                    stats.record('write', sent_at - sending_at)
+                    pacer.sent(len(data), sent_at)
 
             except (BrokenPipeError, ConnectionResetError):
                 log.info("Client disconnected")
             finally:
-                process.terminate()
-                process.wait()
-                active_processes.discard(process)
-                log.info("Camera stopped")
+                broadcaster.unsubscribe(slot)
+                variants.release(profile)
+                log.info("Viewer left: %s (%d frames dropped)", self.address_string(), slot.dropped)
+
+        elif url.path == '/stats':
+            body = json.dumps({
+                'viewers': broadcaster.viewers,
+                'stages': stats.summary(),
+                'h264_viewers': h264_broadcaster.viewers,
+                'h264_stages': h264_broadcaster.stats.summary(),
+            }, indent=2).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        elif url.path == '/log_level':
+            # Admin: /log_level?level=DEBUG[&logger=camera] changes it, without level just reports it
+            query = parse_qs(url.query)
+            logger = query.get('logger', [None])[0]
+            try:
+                level = set_log_level(query.get('level', [None])[0], logger)
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            body = json.dumps({'logger': logger or 'root', 'level': level}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        elif url.path == '/replay' and recorder is not None:
+            self.replay(parse_qs(url.query))
 
         else:
             self.send_error(404)
 
+    def stream_h264(self):
+        """Stream NAL units from the latest keyframe on.
+
+        A WebSocket upgrade gets one binary message per NAL unit (what the
+        viewer page feeds to jmuxer); a plain GET gets the raw Annex-B byte
+        stream as video/h264, e.g. for `ffplay http://<pi-ip>:8080/stream?codec=h264`.
+        """
+        queue = claim_camera(h264_broadcaster, broadcaster)
+        if queue is None:
+            self.send_error(503, "Camera is busy streaming MJPEG")
+            return
+
+        websocket = None
+        h264_stats = h264_broadcaster.stats
+        try:
+            if self.headers.get('Upgrade', '').lower() == 'websocket':
+                self.close_connection = True
+                request = self.raw_requestline + b''.join(
+                    f'{name}: {value}\r\n'.encode('latin-1') for name, value in self.headers.items()) + b'\r\n'
+                websocket = WebSocketSender(self.connection, request)
+                if not websocket.accept():
+                    return
+            else:
+                self.send_response(200)
+                self.send_header('Content-Type', 'video/h264')
+                self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+                self.end_headers()
+            log.info("H.264 viewer connected: %s (%s)", self.address_string(), 'WebSocket' if websocket else 'HTTP')
+
+            while not queue.closed and (websocket is None or websocket.open):
+                frame = queue.get(timeout=1.0)
+                if frame is None:
+                    continue
+                sending_at = time.monotonic()
+                h264_stats.record('queue', sending_at - frame.parsed_at)
+                if websocket:
+                    websocket.send(frame.data)
+                else:
+                    self.connection.sendall(frame.data)
+                h264_stats.record('write', time.monotonic() - sending_at)
+
+        except (BrokenPipeError, ConnectionResetError):
+            log.info("Client disconnected")
+        finally:
+            h264_broadcaster.unsubscribe(queue)
+            log.info("H.264 viewer left: %s (%d NAL units dropped)", self.address_string(), queue.dropped)
+
+    def replay(self, query):
+        """Stream recorded frames from ?t= (unix seconds, or negative = seconds ago) at their original pace."""
+        try:
+            start = float(query.get('t', ['-30'])[0])
+            if not math.isfinite(start):
+                raise ValueError
+        except ValueError:
+            self.send_error(400, "t must be a number")
+            return
+        if start <= 0:
+            start += time.time()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+        self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+        self.end_headers()
+        log.info("Replay for %s from %s", self.address_string(), time.strftime('%H:%M:%S', time.localtime(start)))
+
+        previous = None
+        started = time.monotonic()
+        try:
+            for timestamp, frame in replay_frames(recorder.directory, start):
+                if previous is not None:
+                    time.sleep(min(1.0, max(0.0, timestamp - previous)))
+                previous = timestamp
+                send_part(self.connection, frame, extra=timestamp_headers(timestamp))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        log.info("Replay for %s ended after %.1f s", self.address_string(), time.monotonic() - started)
+
+    @staticmethod
+    def codec(query):
+        return query.get('codec', ['mjpeg'])[0].lower()
+
+    @staticmethod
+    def stream_profile(query):
+        """Build the viewer's StreamProfile from ?fps=&width=&quality= (all optional).
+
+        Raises ValueError unless each given value is a finite number.
+        """
+        def param(name):
+            values = query.get(name)
+            if not values:
+                return None
+            value = float(values[0])
+            if not math.isfinite(value):
+                raise ValueError(f"{name} must be finite")
+            return value
+
+        return StreamProfile(STREAM_WIDTH, STREAM_HEIGHT, STREAM_FRAMERATE,
+                             width=param('width'), quality=param('quality'), fps=param('fps'))
+
     def log_message(self, format, *args):
-        log.debug("%s - %s", self.address_string(), format % args)
+        log.debug("%s - " + format, self.address_string(), *args)
 
 
 def run_server():
-    server = HTTPServer(('0.0.0.0', STREAM_PORT), MJPEGHandler)
+    global recorder
+    if RECORD_DIR:
+        recorder = SegmentRecorder(RECORD_DIR)
+        broadcaster.add_listener(recorder)
+        log.info("Recording streamed video to %s (replay at /replay?t=)", RECORD_DIR)
+
+    server = ThreadingHTTPServer(('0.0.0.0', STREAM_PORT), MJPEGHandler)
     log.info("MJPEG stream available at http://0.0.0.0:%d/stream", STREAM_PORT)
-    log.info("Web viewer at http://0.0.0.0:%d/", STREAM_PORT)
+    log.info("Web viewer at http://0.0.0.0:%d/ (H.264: /?codec=h264)", STREAM_PORT)
 
     def shutdown(sig, frame):
         log.info("Shutting down...")
-        # Kill any active camera processes
-        for proc in list(active_processes):
-            proc.terminate()
+        # Stop the shared camera process and release every viewer
+        broadcaster.close()
+        h264_broadcaster.close()
         # Shutdown server in a thread to avoid deadlock
         Thread(target=server.shutdown).start()
 
@@ -126,6 +432,8 @@ def run_server():
     try:
         server.serve_forever()
     finally:
+        if recorder is not None:
+            recorder.close()
         log.info("Server stopped")
         sys.exit(0)
 
@@ -1,4 +1,5 @@
 """Pin definitions and configuration"""
+import os
 
 # Motor A (left) — physical ENB, polarity inverted
 ENA = 16
@@ -12,7 +13,28 @@ IN4 = 24
 
 # Settings
 DEFAULT_SPEED = 80
-PWM_FREQUENCY = 100
+PWM_FREQUENCY = 100  # RPi.GPIO software PWM
+
+# PWM backend for ENA/ENB: 'rpi_gpio' (software PWM, any pin) or 'sysfs' (kernel hardware
+# PWM — ENA/ENB must then be wired to hardware PWM pins, see README "Hardware PWM")
+PWM_BACKEND = 'rpi_gpio'
+HW_PWM_CHIP = 0          # /sys/class/pwm/pwmchip<N>
+HW_PWM_CHANNEL_A = 0     # PWM0: GPIO12 or GPIO18
+HW_PWM_CHANNEL_B = 1     # PWM1: GPIO13 or GPIO19
+HW_PWM_FREQUENCY = 10000  # Hz; the L298N switches cleanly up to about 25 kHz
 
 # Joystick
 JOYSTICK_DEAD_ZONE = 0.05
+CONTROL_RATE_HZ = 50  # how often the newest motor setpoint is applied
+TELEMETRY_RATE_HZ = 5  # telemetry snapshots per second to subscribed clients
+
+# Simulated hardware for running and profiling off the car: CAR_SIMULATE=1 swaps in sim_gpio.py for RPi.GPIO.
+# CAR_SIM_LATENCY_US adds that many microseconds to every simulated GPIO call.
+SIMULATE = os.environ.get('CAR_SIMULATE', '0') not in ('', '0')
+SIM_LATENCY_US = float(os.environ.get('CAR_SIM_LATENCY_US', '0'))
+
+# Startup: the motor diagnostic is skipped while config and driver code are unchanged since it
+# last passed (results cached in DIAGNOSTICS_CACHE); CAR_DIAGNOSE=1 runs it regardless.
+DIAGNOSTICS_CACHE = os.environ.get('CAR_DIAGNOSTICS_CACHE',
+                                   os.path.expanduser('~/.cache/car-project/diagnostics.json'))
+FORCE_DIAGNOSE = os.environ.get('CAR_DIAGNOSE', '0') not in ('', '0')
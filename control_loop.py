@@ -0,0 +1,113 @@
+"""Fixed-rate motor control loop shared by the WebSocket servers
+
+Command handlers only store a setpoint; one thread applies the newest
+setpoint to the MotorController at a fixed rate, however fast or from however
+many clients commands arrive.
+"""
+import logging
+import math
+import threading
+import time
+
+from utils import LatencyStats
+
+log = logging.getLogger(__name__)
+
+DEFAULT_RATE_HZ = 50
+
+STOPPED = (0.0, 0.0)
+
+
+class ControlLoop:
+    """Applies the latest (left, right) duty setpoint through motor.drive() every tick.
+
+    set() is a single attribute store — atomic under the GIL, so handlers
+    never take a lock or wait for the hardware, and a setpoint that is
+    replaced before the next tick is simply never applied. stop() also wakes
+    the loop so a stop goes out at once instead of at the next tick.
+
+    Per-tick `jitter` (how late the tick started) and `apply` (time spent in
+    drive()) are kept in `stats`; `overruns` counts ticks that took longer
+    than the period.
+    """
+
+    def __init__(self, motor, rate_hz=DEFAULT_RATE_HZ):
+        self.motor = motor
+        self.rate_hz = rate_hz
+        self.period = 1.0 / rate_hz
+        self.stats = LatencyStats(('jitter', 'apply'))
+        self.ticks = 0
+        self.overruns = 0
+        self._setpoint = STOPPED
+        self._applied = None
+        self._wake = threading.Event()
+        self._running = False
+        self._thread = None
+
+    @property
+    def applied(self):
+        """The (left, right) duties last sent to the motors."""
+        return self._applied or STOPPED
+
+    def set(self, left, right):
+        """Request duties for the left and right motors, -100 to 100."""
+        self._setpoint = (left, right)
+
+    def stop(self):
+        self._setpoint = STOPPED
+        self._wake.set()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='control-loop', daemon=True)
+        self._thread.start()
+        log.info("Control loop running at %g Hz", self.rate_hz)
+
+    def close(self):
+        """Stop the loop thread; the motors are stopped on the way out."""
+        self._running = False
+        self.stop()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def summary(self):
+        return {
+            'rate_hz': self.rate_hz,
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            **self.stats.summary(),
+        }
+
+    def _run(self):
+        record = self.stats.record
+        next_tick = time.monotonic()
+
+        while True:
+            woken = self._wake.wait(max(0.0, next_tick - time.monotonic()))
+            if woken:
+                self._wake.clear()
+            started = time.monotonic()
+            if not woken:
+                record('jitter', started - next_tick)
+
+            setpoint = self._setpoint
+            if setpoint != self._applied:
+                try:
+                    self.motor.drive(*setpoint)
+                    self._applied = setpoint
+                except Exception:
+                    log.exception("Control loop failed to apply %s", setpoint)
+            finished = time.monotonic()
+            record('apply', finished - started)
+
+            if not self._running:
+                break
+            if woken:
+                continue  # out-of-band stop; keep the tick schedule
+            self.ticks += 1
+            next_tick += self.period
+            if finished > next_tick:
+                self.overruns += 1
+                # Skip the ticks that were missed rather than bursting to catch up
+                next_tick += math.ceil((finished - next_tick) / self.period) * self.period
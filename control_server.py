@@ -0,0 +1,302 @@
+"""Control WebSocket commands, shared by both hardware profiles
+
+Each profile's websocket_server.py builds one ControlServer around its own
+MotorController and config, so every command is implemented once.
+"""
+import asyncio
+import base64
+import json
+import logging
+
+import websockets
+
+from control_loop import ControlLoop
+from protocol import BinarySession
+from telemetry import RateCounter, TelemetryPublisher, camera_status
+from utils import LogSummary, binary_message, joystick_to_duty, set_log_level
+from video import VideoPublisher
+
+log = logging.getLogger(__name__)
+
+# Commands that need the motors; answered with a "warming_up" status until they are set up
+MOTOR_COMMANDS = {'forward', 'backward', 'left', 'right', 'stop', 'speed', 'joystick', 'control_stats'}
+
+
+class ControlServer:
+    """Connected clients, the motors and the commands they send.
+
+    warmup is the profile's HardwareWarmup. telemetry_extra(motor), if
+    given, returns profile-specific fields for each telemetry snapshot.
+    """
+
+    def __init__(self, warmup, control_rate_hz, telemetry_rate_hz, dead_zone, telemetry_extra=None):
+        self.warmup = warmup
+        self.control_rate_hz = control_rate_hz
+        self.dead_zone = dead_zone
+        self.telemetry_extra = telemetry_extra
+        self.motor = None
+        self.control = None
+        self.commands = RateCounter()
+        self.clients = set()
+        # Per-message logs are DEBUG; at INFO, traffic shows as one line per second of command counts
+        self.received = LogSummary(log, "Commands received")
+        self.telemetry = TelemetryPublisher(self.telemetry_snapshot, telemetry_rate_hz)
+        self.video = VideoPublisher()
+
+    def telemetry_snapshot(self):
+        motor, control = self.motor, self.control
+        snapshot = {
+            'state': self.warmup.state,
+            'clients': len(self.clients),
+            'command_rate': round(self.commands.rate(), 1),
+            'camera': camera_status(),
+        }
+        if control is not None:
+            left, right = control.applied
+            jitter = control.stats.summary()['jitter']
+            snapshot.update(
+                speed=motor.speed,
+                left_motor=round(left, 1),
+                right_motor=round(right, 1),
+                jitter_p50_ms=jitter.get('p50_ms'),
+                jitter_p99_ms=jitter.get('p99_ms'),
+                overruns=control.overruns,
+            )
+            if self.telemetry_extra is not None:
+                snapshot.update(self.telemetry_extra(motor))
+        return snapshot
+
+    async def handle_capture(self, websocket, data):
+        """Take a capture and reply, off the control path.
+
+        Runs as its own task with the camera work on the capture worker pool,
+        so joystick and stop commands keep being handled while it is in flight.
+        """
+        from camera import capture_jpeg_async  # imported on first use, not at startup
+
+        try:
+            width = data.get('width', 640)
+            height = data.get('height', 480)
+            quality = data.get('quality', 80)
+            binary = bool(data.get('binary', False))
+
+            result = await capture_jpeg_async(width=width, height=height, quality=quality)
+
+            if result['success'] and binary:
+                header = {
+                    'status': 'ok',
+                    'command': 'capture',
+                    'format': 'jpeg',
+                    'size': len(result['jpeg']),
+                    'width': result['width'],
+                    'height': result['height'],
+                }
+                log.info("Capture response: success=True binary=True size=%d", header['size'])
+                await websocket.send(binary_message(header, result['jpeg']))
+                return
+
+            if result['success']:
+                response = {
+                    'status': 'ok',
+                    'command': 'capture',
+                    'image': base64.b64encode(result['jpeg']).decode('ascii'),
+                    'width': result['width'],
+                    'height': result['height'],
+                }
+            else:
+                response = {
+                    'status': 'error',
+                    'command': 'capture',
+                    'message': result['error'],
+                }
+
+            log.info("Capture response: success=%s", result['success'])
+            await websocket.send(json.dumps(response))
+        except websockets.exceptions.ConnectionClosed:
+            log.info("Client gone before capture reply: %s", websocket.remote_address)
+
+    async def handle_client(self, websocket):
+        log.info("Client connected: %s", websocket.remote_address)
+        self.warmup.connection_accepted()
+        self.clients.add(websocket)
+        received, commands, telemetry, video = self.received, self.commands, self.telemetry, self.video
+        captures = set()
+        session = None  # binary protocol state, once the client has asked for it
+
+        try:
+            async for message in websocket:
+                motor, control = self.motor, self.control
+                if isinstance(message, bytes):
+                    # Binary motion frame: its own path, no JSON and no per-frame logging
+                    received.count('binary')
+                    commands.add()
+                    if session is None:
+                        await websocket.send(json.dumps({'status': 'error', 'message': 'send a binary hello first'}))
+                        continue
+                    try:
+                        ack = session.handle(message, control, motor)
+                    except ValueError as e:
+                        await websocket.send(json.dumps({'status': 'error', 'message': str(e)}))
+                        continue
+                    if ack is not None:
+                        await websocket.send(ack)
+                    continue
+
+                log.debug("Received: %s", message)
+                try:
+                    data = json.loads(message)
+                except json.JSONDecodeError:
+                    log.warning("Invalid JSON: %s", message)
+                    await websocket.send(json.dumps({'status': 'error', 'message': 'invalid JSON'}))
+                    continue
+
+                command = data.get('command')
+                if not command:
+                    log.warning("Missing 'command' key in message")
+                    await websocket.send(json.dumps({'status': 'error', 'message': 'missing command'}))
+                    continue
+                received.count(command)
+                commands.add()
+
+                if command in MOTOR_COMMANDS and control is None:
+                    await websocket.send(json.dumps(self.warmup.not_ready(command)))
+                    continue
+
+                # Motion commands only update the control loop's setpoint
+                if command == 'forward':
+                    control.set(motor.speed, motor.speed)
+                elif command == 'backward':
+                    control.set(-motor.speed, -motor.speed)
+                elif command == 'left':
+                    control.set(-motor.speed, motor.speed)
+                elif command == 'right':
+                    control.set(motor.speed, -motor.speed)
+                elif command == 'stop':
+                    control.stop()
+                elif command == 'speed':
+                    motor.set_speed(data.get('value', 75))
+                elif command == 'joystick':
+                    try:
+                        left_duty, right_duty = joystick_to_duty(data.get('x', 0), data.get('y', 0),
+                                                                 motor.speed, self.dead_zone)
+                    except (TypeError, ValueError) as e:
+                        await websocket.send(json.dumps({'status': 'error', 'command': command, 'message': str(e)}))
+                        continue
+                    control.set(left_duty, right_duty)
+
+                    response = {
+                        'status': 'ok',
+                        'command': command,
+                        'speed': motor.speed,
+                        'left_motor': round(left_duty, 1),
+                        'right_motor': round(right_duty, 1),
+                    }
+                    reply = json.dumps(response)
+                    log.debug("Response: %s", reply)
+                    await websocket.send(reply)
+                    continue
+                elif command == 'capture':
+                    task = asyncio.create_task(self.handle_capture(websocket, data))
+                    captures.add(task)
+                    task.add_done_callback(captures.discard)
+                    continue
+                elif command == 'capture_stats':
+                    from camera import capture_stats
+                    await websocket.send(json.dumps({'status': 'ok', 'command': command, **capture_stats()}))
+                    continue
+                elif command == 'control_stats':
+                    await websocket.send(json.dumps({'status': 'ok', 'command': command, **control.summary()}))
+                    continue
+                elif command == 'status':
+                    await websocket.send(json.dumps({'status': 'ok', 'command': command, **self.warmup.summary(),
+                                                     'telemetry': telemetry.stats(), 'video': video.stats()}))
+                    continue
+                elif command in ('subscribe', 'unsubscribe'):
+                    topic = data.get('topic', 'telemetry')
+                    if topic == 'telemetry':
+                        if command == 'subscribe':
+                            telemetry.subscribe(websocket)
+                        else:
+                            telemetry.unsubscribe(websocket)
+                        details = {'rate_hz': telemetry.rate_hz}
+                    elif topic == 'video':
+                        # Frames arrive as binary messages on this connection, e.g. {"command": "subscribe", "topic": "video", "fps": 10}
+                        details = {}
+                        if command == 'subscribe':
+                            try:
+                                details['fps'] = await video.subscribe(websocket, data.get('fps'))
+                            except ValueError as e:
+                                await websocket.send(json.dumps({'status': 'error', 'command': command,
+                                                                 'message': str(e)}))
+                                continue
+                        else:
+                            video.unsubscribe(websocket)
+                    else:
+                        await websocket.send(json.dumps({'status': 'error', 'command': command,
+                                                         'message': f'unknown topic: {topic}'}))
+                        continue
+                    await websocket.send(json.dumps({'status': 'ok', 'command': command, 'topic': topic, **details}))
+                    continue
+                elif command == 'log_level':
+                    # Admin: e.g. {"command": "log_level", "level": "DEBUG"} to see every message for a while
+                    logger = data.get('logger')
+                    try:
+                        level = set_log_level(data.get('level'), logger)
+                    except ValueError as e:
+                        await websocket.send(json.dumps({'status': 'error', 'command': command, 'message': str(e)}))
+                        continue
+                    log.info("Log level of %s: %s", logger or 'root', level)
+                    await websocket.send(json.dumps({'status': 'ok', 'command': command,
+                                                     'logger': logger or 'root', 'level': level}))
+                    continue
+                elif command == 'hello':
+                    if data.get('protocol', 'json') == 'binary':
+                        try:
+                            session = BinarySession.negotiate(data, self.dead_zone)
+                        except ValueError as e:
+                            await websocket.send(json.dumps({'status': 'error', 'command': command,
+                                                             'message': str(e)}))
+                            continue
+                        await websocket.send(json.dumps({'status': 'ok', 'command': command, **session.describe()}))
+                    else:
+                        session = None
+                        await websocket.send(json.dumps({'status': 'ok', 'command': command, 'protocol': 'json'}))
+                    continue
+                else:
+                    log.warning("Unknown command: %s", command)
+                    await websocket.send(json.dumps({'status': 'error', 'message': f'unknown command: {command}'}))
+                    continue
+
+                response = {
+                    'status': 'ok',
+                    'command': command,
+                    'speed': motor.speed,
+                }
+                reply = json.dumps(response)
+                log.debug("Response: %s", reply)
+                await websocket.send(reply)
+
+        except websockets.exceptions.ConnectionClosed:
+            log.info("Client disconnected: %s", websocket.remote_address)
+        finally:
+            for task in captures:
+                task.cancel()
+            received.flush()
+            telemetry.unsubscribe(websocket)
+            video.unsubscribe(websocket)
+            self.clients.discard(websocket)
+            if self.control is not None:
+                self.control.stop()
+
+    async def start_motors(self):
+        """Bring the motors up and start the control loop; call once the server is accepting connections."""
+        self.motor = await self.warmup.run()
+        if self.motor is not None:
+            self.control = ControlLoop(self.motor, self.control_rate_hz)
+            self.control.start()
+
+    def shutdown(self):
+        if self.control:
+            self.control.close()
+        if self.warmup.motor:
+            self.warmup.motor.cleanup()
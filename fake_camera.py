@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Stand-in for rpicam-vid that writes canned JPEGs to stdout
+
+Lets the camera code run on a machine without a Pi camera:
+
+    RPICAM_VID=./fake_camera.py python3 camera_server.py
+
+Frames are read from the *.jpg files in FAKE_CAMERA_FRAMES (cycled in name
+order). Without it, small placeholder frames that are not decodable images
+but carry valid JPEG start/end markers are generated instead.
+
+With `--codec h264` placeholder NAL units are written instead: SPS, PPS and
+an IDR slice every `--intra` frames, plain slices in between.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+
+def load_frames(directory):
+    frames = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.jpg'))):
+        with open(path, 'rb') as f:
+            frames.append(f.read())
+    return frames
+
+
+def placeholder_frames(width, height, quality, count=30):
+    frames = []
+    for i in range(count):
+        body = f'fake frame {i} {width}x{height} q{quality}'.encode()
+        frames.append(b'\xff\xd8' + body.ljust(1024, b'\x00') + b'\xff\xd9')
+    return frames
+
+
+def placeholder_nals(width, height, intra):
+    """One group of pictures of undecodable NAL units with the right types and start codes."""
+    def nal(header, text):
+        return b'\x00\x00\x00\x01' + bytes([header]) + text.encode().ljust(256, b'\x55')
+
+    keyframe = nal(0x67, f'sps {width}x{height}') + nal(0x68, 'pps') + nal(0x65, 'idr')
+    return [keyframe] + [nal(0x41, f'slice {i}') for i in range(1, intra)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-t', '--timeout', type=int, default=0)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--framerate', type=float, default=30)
+    parser.add_argument('--quality', type=int, default=93)
+    parser.add_argument('--codec', default='mjpeg')
+    parser.add_argument('--intra', type=int, default=15)
+    parser.add_argument('-o', '--output', default='-')
+    args, _unknown = parser.parse_known_args()
+
+    if args.codec == 'h264':
+        frames = placeholder_nals(args.width, args.height, max(1, args.intra))
+    else:
+        directory = os.environ.get('FAKE_CAMERA_FRAMES')
+        frames = load_frames(directory) if directory else []
+        if not frames:
+            frames = placeholder_frames(args.width, args.height, args.quality)
+
+    out = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+    interval = 1.0 / args.framerate
+    deadline = time.monotonic() + args.timeout / 1000 if args.timeout else None
+    next_frame = time.monotonic()
+    i = 0
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            out.write(frames[i % len(frames)])
+            out.flush()
+            i += 1
+            next_frame += interval
+            time.sleep(max(0.0, next_frame - time.monotonic()))
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+
+
+if __name__ == "__main__":
+    main()
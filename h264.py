@@ -0,0 +1,177 @@
+"""H.264 Annex-B stream splitting and a keyframe-aware broadcaster
+
+rpicam-vid with `--codec h264 --inline` writes a byte stream of NAL units,
+each preceded by a 00 00 01 or 00 00 00 01 start code, and repeats the SPS
+and PPS before every IDR (key) frame. The stream is split into NAL units that
+viewers receive one at a time, always starting at the most recent keyframe so
+their decoder can begin straight away.
+"""
+import collections
+import logging
+import threading
+import time
+
+from camera import Frame, FrameBroadcaster
+from mjpeg import READ_SIZE
+
+log = logging.getLogger(__name__)
+
+START_CODE = b'\x00\x00\x00\x01'
+
+# nal_unit_type values
+NAL_SLICE = 1
+NAL_IDR = 5
+NAL_SPS = 7
+NAL_PPS = 8
+
+QUEUE_NALS = 64      # NAL units a viewer may fall behind before it is resynced (keep above one GOP)
+GOP_MAX_NALS = 512   # stop caching a GOP this long (keyframes are missing from the stream)
+
+
+def nal_type(nal):
+    """nal_unit_type of a NAL unit that starts with a 4-byte start code."""
+    return nal[4] & 0x1F
+
+
+class NALSplitter:
+    """Incremental Annex-B splitter.
+
+    feed() returns every NAL unit completed by the chunk, normalized to a
+    4-byte start code. A NAL unit is only known to be complete once the next
+    start code arrives, so each one is held back until then.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._start = None  # payload offset of the NAL unit in progress
+        self._scan = 0
+
+    def feed(self, chunk):
+        buffer = self._buffer
+        buffer += chunk
+        nals = []
+
+        while True:
+            i = buffer.find(b'\x00\x00\x01', self._scan)
+            if i < 0:
+                break
+            if self._start is not None:
+                # trailing zeros belong to a 4-byte start code or are padding
+                payload = bytes(buffer[self._start:i]).rstrip(b'\x00')
+                if payload:
+                    nals.append(START_CODE + payload)
+            self._start = self._scan = i + 3
+
+        if self._start is None:
+            consumed = max(0, len(buffer) - 2)
+            self._scan = 0
+        else:
+            consumed = self._start
+            self._start = 0
+            self._scan = max(0, len(buffer) - consumed - 2)
+        del buffer[:consumed]
+        return nals
+
+
+class NALQueue:
+    """Per-viewer queue of NAL unit Frames.
+
+    Unlike JPEGs, H.264 units cannot be skipped one by one, so a viewer that
+    falls QUEUE_NALS behind has its queue dropped and resumes at the next SPS
+    (which starts a keyframe). A new queue likewise ignores everything until
+    the first SPS it is given.
+    """
+
+    def __init__(self, maxlen=QUEUE_NALS):
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._maxlen = maxlen
+        self._resync = True
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, frame):
+        with self._cond:
+            if len(self._queue) >= self._maxlen:
+                self.dropped += len(self._queue)
+                self._queue.clear()
+                self._resync = True
+            if self._resync:
+                if nal_type(frame.data) != NAL_SPS:
+                    self.dropped += 1
+                    return
+                self._resync = False
+            self._queue.append(frame)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Return the oldest queued NAL Frame, or None on timeout / once the queue is closed."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._queue or self.closed, timeout)
+            return self._queue.popleft() if self._queue else None
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class H264Broadcaster(FrameBroadcaster):
+    """FrameBroadcaster for an H.264 camera process, publishing one Frame per NAL unit.
+
+    Everything since the last SPS is kept, and a new subscriber is handed that
+    group of pictures before it joins, so it starts on the latest keyframe
+    instead of waiting up to a full intra period for the next one.
+    """
+
+    slot_factory = NALQueue
+
+    def __init__(self, cmd):
+        super().__init__(cmd)
+        self._gop_lock = threading.Lock()
+        self._gop = []
+
+    def subscribe(self, slot=None):
+        if slot is None:
+            slot = self.slot_factory()
+        # Held across the prefill and joining so no NAL unit is missed or repeated
+        with self._gop_lock:
+            for frame in self._gop:
+                slot.put(frame)
+            return super().subscribe(slot)
+
+    def _publish(self, stdout):
+        splitter = NALSplitter()
+        read = stdout.read1
+        record = self.stats.record
+        unit_started = None
+
+        while True:
+            chunk = read(READ_SIZE)
+            read_at = time.monotonic()
+            if not chunk:
+                break
+            if unit_started is None:
+                unit_started = read_at
+
+            nals = splitter.feed(chunk)
+            if not nals:
+                continue
+            parsed_at = time.monotonic()
+            timestamp = time.time()
+            record('read', read_at - unit_started)
+            record('parse', parsed_at - read_at)
+            unit_started = None
+
+            with self._gop_lock:
+                for data in nals:
+                    frame = Frame(data, timestamp, read_at, parsed_at)
+                    if nal_type(data) == NAL_SPS:
+                        self._gop = []
+                    if len(self._gop) < GOP_MAX_NALS:
+                        self._gop.append(frame)
+                    for slot in self._targets:
+                        slot.put(frame)
+
+        with self._gop_lock:
+            self._gop = []
@@ -5,12 +5,9 @@ import tty
 import termios
 import time
 from motor_controller import MotorController
+from utils import setup_logging
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    datefmt="%H:%M:%S",
-)
+setup_logging(logging.DEBUG)
 log = logging.getLogger(__name__)
 
 def get_key():
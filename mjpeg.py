@@ -0,0 +1,243 @@
+"""MJPEG byte-stream parsing and multipart frame emission
+
+Run directly to benchmark the frame extractor against a recorded stream:
+
+    rpicam-vid -t 10000 --codec mjpeg --nopreview -o recording.mjpeg
+    python3 mjpeg.py recording.mjpeg
+"""
+import argparse
+import fcntl
+import logging
+import struct
+import termios
+import time
+
+log = logging.getLogger(__name__)
+
+SOI = b'\xff\xd8'  # JPEG start of image
+EOI = b'\xff\xd9'  # JPEG end of image
+
+READ_SIZE = 65536
+
+# Per-viewer adaptive pacing
+LATENCY_BUDGET = 0.25   # seconds of video allowed to sit in a viewer's socket buffer
+MIN_FRAMERATE = 1.0     # never pace a viewer below this
+RATE_DECREASE = 0.7     # multiplicative back-off when the viewer falls behind
+RATE_INCREASE = 0.25    # frames/s regained per frame sent while the link keeps up
+
+
+class FrameExtractor:
+    """Incremental JPEG frame splitter for a concatenated MJPEG byte stream.
+
+    Data is appended to one bytearray and scanning resumes where the previous
+    call stopped, so every byte is examined once no matter how many chunks a
+    frame arrives in. An end marker is only looked for after a start marker,
+    so stray bytes between frames can never swallow the next frame.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._start = -1  # offset of the current frame's SOI, -1 while between frames
+        self._scan = 0    # offset where the next marker search resumes
+
+    def feed(self, chunk):
+        """Append a chunk and return the list of frames it completed."""
+        buffer = self._buffer
+        buffer += chunk
+        frames = []
+        consumed = 0
+
+        while True:
+            if self._start < 0:
+                start = buffer.find(SOI, self._scan)
+                if start < 0:
+                    # Keep a trailing 0xFF in case the marker is split across reads
+                    consumed = self._scan = max(self._scan, len(buffer) - 1)
+                    break
+                self._start = start
+                self._scan = start + 2
+
+            end = buffer.find(EOI, self._scan)
+            if end < 0:
+                self._scan = max(self._scan, len(buffer) - 1)
+                break
+            frames.append(bytes(buffer[self._start:end + 2]))
+            consumed = end + 2
+            self._start = -1
+            self._scan = consumed
+
+        if consumed > 0:
+            del buffer[:consumed]
+            self._scan -= consumed
+            if self._start >= 0:
+                self._start -= consumed
+        return frames
+
+    @property
+    def pending(self):
+        """True while part of a frame is buffered."""
+        return self._start >= 0
+
+    def read_frames(self, stream, read_size=READ_SIZE):
+        """Yield frames from a binary file object until EOF."""
+        read = getattr(stream, 'read1', stream.read)
+        while True:
+            chunk = read(read_size)
+            if not chunk:
+                return
+            yield from self.feed(chunk)
+
+
+def part_header(length, content_type=b'image/jpeg', boundary=b'frame', extra=b''):
+    """Multipart part header; extra holds additional header lines, each ending in CRLF."""
+    return b'--%s\r\nContent-Type: %s\r\nContent-Length: %d\r\n%s\r\n' % (boundary, content_type, length, extra)
+
+
+def timestamp_headers(timestamp):
+    """X-Timestamp: when the frame was read from the camera; X-Sent-Timestamp: now (both unix seconds)."""
+    return b'X-Timestamp: %.6f\r\nX-Sent-Timestamp: %.6f\r\n' % (timestamp, time.time())
+
+
+def send_part(sock, frame, boundary=b'frame', extra=b''):
+    """Send one multipart part (header, JPEG, trailer) with a vectored write.
+
+    The frame is never concatenated with its header; partial sends are
+    resumed from a memoryview of whatever is left.
+    """
+    send_buffers(sock, [part_header(len(frame), boundary=boundary, extra=extra), frame, b'\r\n'])
+
+
+def send_buffers(sock, buffers):
+    """sendmsg() a list of buffers until all of it is written; the list is consumed."""
+    while buffers:
+        sent = sock.sendmsg(buffers)
+        while sent:
+            if sent >= len(buffers[0]):
+                sent -= len(buffers.pop(0))
+            else:
+                buffers[0] = memoryview(buffers[0])[sent:]
+                sent = 0
+
+
+def queued_bytes(sock):
+    """Bytes written to sock that the peer has not acknowledged yet (Linux SIOCOUTQ)."""
+    try:
+        return struct.unpack('i', fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, b'\0\0\0\0'))[0]
+    except OSError:
+        return 0
+
+
+class AdaptivePacer:
+    """Per-viewer frame rate control that keeps stream latency bounded.
+
+    Right before each frame goes out, the viewer's send-queue depth is read
+    and its drain rate (bytes the peer acknowledged per second) updated.
+    When the queued bytes would take longer than `latency_budget` to drain,
+    the frame rate is cut multiplicatively; while the queue stays short it
+    creeps back up to `max_fps`. Skipped frames are simply never sent — the
+    caller always sends the newest frame once the next one is due.
+    """
+
+    def __init__(self, max_fps, min_fps=MIN_FRAMERATE, latency_budget=LATENCY_BUDGET):
+        self.max_fps = max_fps
+        self.min_fps = min(min_fps, max_fps)
+        self.latency_budget = latency_budget
+        self.fps = max_fps
+        self.drain_rate = None  # bytes/s, smoothed
+        self.queued = 0
+        self._sent_total = 0
+        self._frame_bytes = 0
+        self._delivered = 0
+        self._measured_at = time.monotonic()
+        self._next_due = 0.0
+
+    def wait_time(self, now):
+        """Seconds to hold off before the next frame may be sent."""
+        return max(0.0, self._next_due - now)
+
+    def update(self, queued, now):
+        """Adjust the pace from the viewer's queue depth just before the next send."""
+        delivered = self._sent_total - queued
+        elapsed = now - self._measured_at
+        if elapsed > 0 and delivered > self._delivered:
+            rate = (delivered - self._delivered) / elapsed
+            if self.drain_rate is None:
+                self.drain_rate = rate
+            elif self.queued:
+                self.drain_rate = 0.8 * self.drain_rate + 0.2 * rate
+            else:
+                # The queue ran dry, so this sample only shows what we sent
+                self.drain_rate = max(self.drain_rate, rate)
+            self._delivered = delivered
+            self._measured_at = now
+        self.queued = queued
+
+        backlog = queued / self.drain_rate if self.drain_rate else 0.0
+        if backlog > self.latency_budget:
+            self.fps = max(self.min_fps, self.fps * RATE_DECREASE)
+            if self._frame_bytes:
+                # Never ask for more than the measured link can carry
+                self.fps = max(self.min_fps, min(self.fps, 0.9 * self.drain_rate / self._frame_bytes))
+        elif backlog < self.latency_budget / 4:
+            self.fps = min(self.max_fps, self.fps + RATE_INCREASE)
+
+    def sent(self, frame_bytes, now):
+        self._sent_total += frame_bytes
+        self._frame_bytes = frame_bytes
+        self._next_due = max(self._next_due + 1.0 / self.fps, now)
+
+
+def _legacy_frames(data, chunk_size):
+    """The original bytes-concatenating parser, kept as a benchmark baseline."""
+    buffer = b''
+    for offset in range(0, len(data), chunk_size):
+        buffer += data[offset:offset + chunk_size]
+        while True:
+            start = buffer.find(SOI)
+            end = buffer.find(EOI)
+            if start != -1 and end != -1 and end > start:
+                yield buffer[start:end + 2]
+                buffer = buffer[end + 2:]
+            else:
+                break
+
+
+def _extractor_frames(data, chunk_size):
+    extractor = FrameExtractor()
+    view = memoryview(data)
+    for offset in range(0, len(data), chunk_size):
+        yield from extractor.feed(view[offset:offset + chunk_size])
+
+
+def benchmark(path, chunk_size=4096, repeat=5, legacy=False):
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    parsers = [('extractor', _extractor_frames)]
+    if legacy:
+        parsers.append(('legacy', _legacy_frames))
+
+    for name, parse in parsers:
+        frames = 0
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        for _ in range(repeat):
+            for _frame in parse(data, chunk_size):
+                frames += 1
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        if not frames:
+            print(f"{name}: no frames found in {path}")
+            continue
+        print(f"{name}: {frames // repeat} frames/pass, {frames / wall:,.0f} frames/s, "
+              f"{cpu / frames * 1e6:.1f} us CPU/frame ({chunk_size} B reads)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded MJPEG stream through the frame parser")
+    parser.add_argument('recording', help="raw MJPEG file, e.g. from rpicam-vid --codec mjpeg -o file")
+    parser.add_argument('--chunk', type=int, default=4096, help="read size in bytes (default: 4096)")
+    parser.add_argument('--repeat', type=int, default=5, help="passes over the recording (default: 5)")
+    parser.add_argument('--legacy', action='store_true', help="also time the original parser for comparison")
+    args = parser.parse_args()
+    benchmark(args.recording, args.chunk, args.repeat, args.legacy)
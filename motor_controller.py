@@ -1,30 +1,62 @@
 """Core motor control functionality"""
 import logging
 import time
-import RPi.GPIO as GPIO
 from config import *
 
+if SIMULATE:
+    import sim_gpio as GPIO
+    GPIO.latency = SIM_LATENCY_US / 1e6
+else:
+    import RPi.GPIO as GPIO
+from pwm import SoftwarePWM, SysfsPWM
+
 log = logging.getLogger(__name__)
 
+# Direction pin levels for (left forward, right forward)
+DIRECTIONS = {
+    (left, right): {
+        IN1: GPIO.HIGH if left else GPIO.LOW,
+        IN2: GPIO.LOW if left else GPIO.HIGH,
+        IN3: GPIO.HIGH if right else GPIO.LOW,
+        IN4: GPIO.LOW if right else GPIO.HIGH,
+    }
+    for left in (True, False) for right in (True, False)
+}
+STOPPED = dict.fromkeys((IN1, IN2, IN3, IN4), GPIO.LOW)
+
 class MotorController:
     def __init__(self):
         self.speed = DEFAULT_SPEED
         self.pwm_a = None
         self.pwm_b = None
+        # Last level written to each direction pin and duty to each PWM, so only changes are written
+        self._levels = {}
+        self._duty = {}
         self.setup()
 
     def setup(self):
         GPIO.setmode(GPIO.BCM)
         GPIO.setwarnings(False)
-        GPIO.setup([ENA, IN1, IN2, ENB, IN3, IN4], GPIO.OUT)
+        GPIO.setup([IN1, IN2, IN3, IN4], GPIO.OUT)
 
-        self.pwm_a = GPIO.PWM(ENA, PWM_FREQUENCY)
-        self.pwm_b = GPIO.PWM(ENB, PWM_FREQUENCY)
-        self.pwm_a.start(0)
-        self.pwm_b.start(0)
+        self.pwm_a = self._open_pwm(ENA, HW_PWM_CHANNEL_A)
+        self.pwm_b = self._open_pwm(ENB, HW_PWM_CHANNEL_B)
+        self._duty = {self.pwm_a: 0, self.pwm_b: 0}
         log.info("GPIO setup complete — pins: ENA=%d IN1=%d IN2=%d ENB=%d IN3=%d IN4=%d",
                  ENA, IN1, IN2, ENB, IN3, IN4)
-        log.info("PWM frequency: %d Hz, default speed: %d%%", PWM_FREQUENCY, DEFAULT_SPEED)
+        log.info("Default speed: %d%%", DEFAULT_SPEED)
+
+    @staticmethod
+    def _open_pwm(pin, channel):
+        """Hardware PWM when PWM_BACKEND is 'sysfs' and the channel can be opened, else RPi.GPIO software PWM."""
+        if PWM_BACKEND == 'sysfs':
+            try:
+                return SysfsPWM(HW_PWM_CHIP, channel, HW_PWM_FREQUENCY)
+            except OSError as e:
+                log.warning("Hardware PWM pwmchip%d/pwm%d unavailable (%s) — using software PWM on GPIO %d",
+                            HW_PWM_CHIP, channel, e, pin)
+        log.info("Software PWM on GPIO %d at %d Hz", pin, PWM_FREQUENCY)
+        return SoftwarePWM(pin, PWM_FREQUENCY, GPIO)
 
     def diagnose(self, pulse_duration=0.3):
         """Pulse each motor individually so the user can verify connections.
@@ -39,11 +71,11 @@ class MotorController:
         log.info("Testing Motor A (ENA=%d, IN1=%d, IN2=%d) — should spin forward briefly", ENA, IN1, IN2)
         GPIO.output(IN1, GPIO.HIGH)
         GPIO.output(IN2, GPIO.LOW)
-        self.pwm_a.ChangeDutyCycle(60)
+        self.pwm_a.set_duty(60)
         time.sleep(pulse_duration)
         a_in1 = GPIO.input(IN1)
         a_in2 = GPIO.input(IN2)
-        self.pwm_a.ChangeDutyCycle(0)
+        self.pwm_a.set_duty(0)
         GPIO.output(IN1, GPIO.LOW)
         results['motor_a'] = {'IN1': a_in1, 'IN2': a_in2, 'expected': 'IN1=1 IN2=0'}
         log.info("  Motor A readback: IN1=%d IN2=%d (expected 1/0)", a_in1, a_in2)
@@ -56,11 +88,11 @@ class MotorController:
         log.info("Testing Motor B (ENB=%d, IN3=%d, IN4=%d) — should spin forward briefly", ENB, IN3, IN4)
         GPIO.output(IN3, GPIO.HIGH)
         GPIO.output(IN4, GPIO.LOW)
-        self.pwm_b.ChangeDutyCycle(60)
+        self.pwm_b.set_duty(60)
         time.sleep(pulse_duration)
         b_in3 = GPIO.input(IN3)
         b_in4 = GPIO.input(IN4)
-        self.pwm_b.ChangeDutyCycle(0)
+        self.pwm_b.set_duty(0)
         GPIO.output(IN3, GPIO.LOW)
         results['motor_b'] = {'IN3': b_in3, 'IN4': b_in4, 'expected': 'IN3=1 IN4=0'}
         log.info("  Motor B readback: IN3=%d IN4=%d (expected 1/0)", b_in3, b_in4)
@@ -73,50 +105,64 @@ class MotorController:
         else:
             log.warning("=== Diagnostic FAILED — review warnings above ===")
 
+        # The pins were driven directly above
+        self._levels.clear()
+        self._duty.clear()
+
         results['ok'] = ok
         return results
-    
+
+    def _apply(self, levels, duty_a, duty_b):
+        """Bring the direction pins and both duty cycles to the given state, writing only changes.
+
+        Changed direction pins go out in one list-form GPIO.output call. A
+        duty that drops is lowered before the pins switch and one that rises
+        is raised after; a motor whose pins change is brought to duty 0
+        first. So a motor never briefly runs at its old speed in its new
+        direction.
+        """
+        raised = []
+        for pwm, duty, pins in ((self.pwm_a, duty_a, (IN1, IN2)), (self.pwm_b, duty_b, (IN3, IN4))):
+            current = self._duty.get(pwm)
+            if current and any(self._levels.get(pin) != levels[pin] for pin in pins):
+                pwm.set_duty(0)
+                self._duty[pwm] = current = 0
+            if duty == current:
+                continue
+            if current is not None and duty > current:
+                raised.append((pwm, duty))
+            else:
+                pwm.set_duty(duty)
+                self._duty[pwm] = duty
+
+        pins = [pin for pin, level in levels.items() if self._levels.get(pin) != level]
+        if pins:
+            GPIO.output(pins, [levels[pin] for pin in pins])
+            self._levels.update(levels)
+
+        for pwm, duty in raised:
+            pwm.set_duty(duty)
+            self._duty[pwm] = duty
+
     def forward(self):
         log.debug("forward — speed=%d%%", self.speed)
-        GPIO.output(IN1, GPIO.HIGH)
-        GPIO.output(IN2, GPIO.LOW)
-        GPIO.output(IN3, GPIO.HIGH)
-        GPIO.output(IN4, GPIO.LOW)
-        self.pwm_a.ChangeDutyCycle(self.speed)
-        self.pwm_b.ChangeDutyCycle(self.speed)
+        self._apply(DIRECTIONS[(True, True)], self.speed, self.speed)
 
     def backward(self):
         log.debug("backward — speed=%d%%", self.speed)
-        GPIO.output(IN1, GPIO.LOW)
-        GPIO.output(IN2, GPIO.HIGH)
-        GPIO.output(IN3, GPIO.LOW)
-        GPIO.output(IN4, GPIO.HIGH)
-        self.pwm_a.ChangeDutyCycle(self.speed)
-        self.pwm_b.ChangeDutyCycle(self.speed)
+        self._apply(DIRECTIONS[(False, False)], self.speed, self.speed)
 
     def left(self):
         log.debug("left — speed=%d%%", self.speed)
-        GPIO.output(IN1, GPIO.LOW)
-        GPIO.output(IN2, GPIO.HIGH)
-        GPIO.output(IN3, GPIO.HIGH)
-        GPIO.output(IN4, GPIO.LOW)
-        self.pwm_a.ChangeDutyCycle(self.speed)
-        self.pwm_b.ChangeDutyCycle(self.speed)
+        self._apply(DIRECTIONS[(False, True)], self.speed, self.speed)
 
     def right(self):
         log.debug("right — speed=%d%%", self.speed)
-        GPIO.output(IN1, GPIO.HIGH)
-        GPIO.output(IN2, GPIO.LOW)
-        GPIO.output(IN3, GPIO.LOW)
-        GPIO.output(IN4, GPIO.HIGH)
-        self.pwm_a.ChangeDutyCycle(self.speed)
-        self.pwm_b.ChangeDutyCycle(self.speed)
+        self._apply(DIRECTIONS[(True, False)], self.speed, self.speed)
 
     def stop(self):
         log.debug("stop")
-        self.pwm_a.ChangeDutyCycle(0)
-        self.pwm_b.ChangeDutyCycle(0)
-        GPIO.output([IN1, IN2, IN3, IN4], GPIO.LOW)
+        self._apply(STOPPED, 0, 0)
     
     def set_speed(self, speed):
         self.speed = max(0, min(100, speed))
@@ -137,28 +183,16 @@ class MotorController:
             left_speed: -100 to 100 (negative = backward)
             right_speed: -100 to 100 (negative = backward)
         """
-        log.debug("drive — left=%.1f right=%.1f", left_speed, right_speed)
+        if log.isEnabledFor(logging.DEBUG):  # called for every joystick message
+            log.debug("drive — left=%.1f right=%.1f", left_speed, right_speed)
         left_speed = max(-100, min(100, left_speed))
         right_speed = max(-100, min(100, right_speed))
 
-        if left_speed >= 0:
-            GPIO.output(IN1, GPIO.HIGH)
-            GPIO.output(IN2, GPIO.LOW)
-        else:
-            GPIO.output(IN1, GPIO.LOW)
-            GPIO.output(IN2, GPIO.HIGH)
-
-        if right_speed >= 0:
-            GPIO.output(IN3, GPIO.HIGH)
-            GPIO.output(IN4, GPIO.LOW)
-        else:
-            GPIO.output(IN3, GPIO.LOW)
-            GPIO.output(IN4, GPIO.HIGH)
-
-        self.pwm_a.ChangeDutyCycle(abs(left_speed))
-        self.pwm_b.ChangeDutyCycle(abs(right_speed))
+        self._apply(DIRECTIONS[(left_speed >= 0, right_speed >= 0)], abs(left_speed), abs(right_speed))
 
     def cleanup(self):
         log.info("Cleaning up GPIO")
         self.stop()
+        self.pwm_a.close()
+        self.pwm_b.close()
         GPIO.cleanup()
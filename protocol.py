@@ -0,0 +1,138 @@
+"""Binary control protocol for high-rate joystick traffic
+
+A client opts in with a JSON hello:
+
+    {"command": "hello", "protocol": "binary", "ack": "batch", "ack_every": 10}
+
+and then sends motion commands as binary WebSocket messages, one fixed-size
+REQUEST frame each. Other commands (capture, stats, ...) stay JSON text.
+
+REQUEST, 16 bytes, little-endian:
+    B   command id (COMMANDS)
+    x   padding
+    H   sequence number, wrapping at 65536
+    f   x  (joystick), or the speed percentage for SPEED
+    f   y  (joystick)
+    I   client timestamp in ms, echoed back for round-trip timing
+
+ACK, 12 bytes, little-endian:
+    B   command id
+    B   status (OK, or WARMING_UP: not applied, the motors are not set up yet)
+    H   sequence number of the newest frame acknowledged
+    I   its client timestamp
+    b   left motor duty, -100..100
+    b   right motor duty, -100..100
+    B   speed setting
+    B   frames acknowledged by this ack
+
+Acknowledgements are sent for every frame ("all"), for every ack_every-th
+frame ("batch"), or never ("none"). Stop and speed are acknowledged in every
+mode.
+"""
+import math
+import struct
+
+from utils import joystick_to_duty
+
+PROTOCOL_VERSION = 1
+
+REQUEST = struct.Struct('<BxHffI')
+ACK = struct.Struct('<BBHIbbBB')
+
+JOYSTICK, FORWARD, BACKWARD, LEFT, RIGHT, STOP, SPEED = range(1, 8)
+COMMANDS = {
+    'joystick': JOYSTICK, 'forward': FORWARD, 'backward': BACKWARD,
+    'left': LEFT, 'right': RIGHT, 'stop': STOP, 'speed': SPEED,
+}
+
+OK, WARMING_UP = 0, 1
+
+ACK_ALL, ACK_BATCH, ACK_NONE = 'all', 'batch', 'none'
+DEFAULT_ACK_EVERY = 10
+
+
+def request(command, seq, x=0.0, y=0.0, timestamp_ms=0):
+    """Pack a REQUEST frame (for clients and benchmarks)."""
+    return REQUEST.pack(command, seq & 0xFFFF, x, y, timestamp_ms & 0xFFFFFFFF)
+
+
+class BinarySession:
+    """One client's binary protocol state: decodes frames, updates the control loop, builds acks."""
+
+    def __init__(self, ack=ACK_ALL, ack_every=DEFAULT_ACK_EVERY, dead_zone=0.0):
+        self.ack = ack
+        self.ack_every = max(1, ack_every)
+        self.dead_zone = dead_zone
+        self.frames = 0
+        self._unacked = 0
+
+    @classmethod
+    def negotiate(cls, hello, dead_zone):
+        """Session for a hello message; raises ValueError for options it cannot honour."""
+        ack = hello.get('ack', ACK_ALL)
+        if ack not in (ACK_ALL, ACK_BATCH, ACK_NONE):
+            raise ValueError(f"unknown ack mode: {ack}")
+        try:
+            ack_every = int(hello.get('ack_every', DEFAULT_ACK_EVERY))
+        except (TypeError, ValueError):
+            raise ValueError(f"ack_every must be a number, got {hello.get('ack_every')!r}")
+        return cls(ack, ack_every, dead_zone)
+
+    def describe(self):
+        return {
+            'protocol': 'binary',
+            'version': PROTOCOL_VERSION,
+            'ack': self.ack,
+            'ack_every': self.ack_every,
+            'request_bytes': REQUEST.size,
+            'ack_bytes': ACK.size,
+        }
+
+    def handle(self, frame, control, motor):
+        """Apply one REQUEST frame; returns the ACK to send, or None.
+
+        control is None while the motors are warming up: the frame is then
+        answered with WARMING_UP and not applied. Raises ValueError for a
+        frame of the wrong size, an unknown command or a NaN/infinite x or y.
+        """
+        if len(frame) != REQUEST.size:
+            raise ValueError(f"expected a {REQUEST.size}-byte frame, got {len(frame)}")
+        command, seq, x, y, timestamp = REQUEST.unpack(frame)
+        if not (math.isfinite(x) and math.isfinite(y)):
+            raise ValueError(f"x and y must be finite, got {x} and {y}")
+        self.frames += 1
+        self._unacked += 1
+        left = right = 0.0
+
+        if control is None:
+            status = WARMING_UP
+        elif command == JOYSTICK:
+            status = OK
+            left, right = joystick_to_duty(x, y, motor.speed, self.dead_zone)
+            control.set(left, right)
+        elif command == STOP:
+            status = OK
+            control.stop()
+        elif command == SPEED:
+            status = OK
+            motor.set_speed(x)
+        elif FORWARD <= command <= RIGHT:
+            status = OK
+            speed = motor.speed
+            left, right = {
+                FORWARD: (speed, speed), BACKWARD: (-speed, -speed),
+                LEFT: (-speed, speed), RIGHT: (speed, -speed),
+            }[command]
+            control.set(left, right)
+        else:
+            raise ValueError(f"unknown command id: {command}")
+
+        urgent = command in (STOP, SPEED) or status != OK
+        if self.ack == ACK_NONE and not urgent:
+            self._unacked = 0
+            return None
+        if self.ack == ACK_BATCH and not urgent and self._unacked < self.ack_every:
+            return None
+        count, self._unacked = min(self._unacked, 255), 0
+        speed = motor.speed if motor is not None else 0
+        return ACK.pack(command, status, seq, timestamp, round(left), round(right), int(speed), count)
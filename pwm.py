@@ -0,0 +1,88 @@
+"""PWM backends for the L298N enable pins
+
+SoftwarePWM is RPi.GPIO's software PWM: a thread per pin toggling it from
+user space, which costs CPU and jitters when the Pi is busy. SysfsPWM drives
+the SoC's PWM peripheral through /sys/class/pwm, so the waveform is
+generated in hardware at any frequency and costs nothing between duty
+changes. Both take duty cycles in percent through set_duty().
+"""
+import logging
+import os
+import time
+
+log = logging.getLogger(__name__)
+
+SYSFS_PWM_ROOT = '/sys/class/pwm'
+EXPORT_TIMEOUT = 1.0  # seconds to wait for udev to set up a freshly exported channel
+
+
+class SoftwarePWM:
+    """`gpio` is the RPi.GPIO module, or a stand-in such as sim_gpio."""
+
+    def __init__(self, pin, frequency, gpio=None):
+        if gpio is None:
+            import RPi.GPIO as gpio
+
+        gpio.setup(pin, gpio.OUT)
+        self._pwm = gpio.PWM(pin, frequency)
+        self._pwm.start(0)
+
+    def set_duty(self, percent):
+        self._pwm.ChangeDutyCycle(percent)
+
+    def close(self):
+        self._pwm.stop()
+
+
+class SysfsPWM:
+    """One channel of a kernel PWM chip, e.g. /sys/class/pwm/pwmchip0/pwm0.
+
+    The duty_cycle attribute is kept open so set_duty() is a single pwrite.
+    `root` can point at a fake directory tree: if the pwmN directory already
+    exists the channel is not exported again.
+    """
+
+    def __init__(self, chip, channel, frequency, root=SYSFS_PWM_ROOT):
+        chip_path = os.path.join(root, f'pwmchip{chip}')
+        self.path = os.path.join(chip_path, f'pwm{channel}')
+        self._chip_path = chip_path
+        self._channel = channel
+        self.period_ns = round(1e9 / frequency)
+
+        if not os.path.isdir(self.path):
+            self._write(os.path.join(chip_path, 'export'), channel)
+            self._wait_exported()
+        # duty_cycle may never exceed period, so clear it before changing the period
+        self._write_attr('duty_cycle', 0)
+        self._write_attr('period', self.period_ns)
+        self._write_attr('enable', 1)
+        self._duty_fd = os.open(os.path.join(self.path, 'duty_cycle'), os.O_WRONLY)
+        log.info("Hardware PWM %s at %d Hz", self.path, frequency)
+
+    @staticmethod
+    def _write(path, value):
+        with open(path, 'w') as f:
+            f.write(str(value))
+
+    def _write_attr(self, name, value):
+        self._write(os.path.join(self.path, name), value)
+
+    def _wait_exported(self):
+        deadline = time.monotonic() + EXPORT_TIMEOUT
+        enable = os.path.join(self.path, 'enable')
+        while not os.access(enable, os.W_OK):
+            if time.monotonic() > deadline:
+                raise OSError(f"{self.path} did not become writable after export")
+            time.sleep(0.01)
+
+    def set_duty(self, percent):
+        os.pwrite(self._duty_fd, b'%d' % int(self.period_ns * percent / 100), 0)
+
+    def close(self):
+        self.set_duty(0)
+        os.close(self._duty_fd)
+        self._write_attr('enable', 0)
+        try:
+            self._write(os.path.join(self._chip_path, 'unexport'), self._channel)
+        except OSError:
+            pass
@@ -0,0 +1,256 @@
+"""Segmented on-device recording of the MJPEG stream, with a seekable frame index
+
+Frames are appended to size-capped segment files `segment-<ms>.mjpeg`, where
+<ms> is the wall-clock time of the segment's first frame. Each segment has a
+sibling `.idx` file holding one fixed-size record per frame:
+
+    <timestamp: float64 seconds><offset: uint64><length: uint32>   (little-endian)
+
+so replay can binary-search for a time and slice frames out of an mmap of the
+segment without parsing it.
+"""
+import glob
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+INDEX_RECORD = struct.Struct('<dQI')
+
+SEGMENT_BYTES = 64 * 1024 * 1024   # start a new segment past this size
+MAX_SEGMENTS = 16                  # oldest segments are deleted beyond this
+QUEUE_FRAMES = 256                 # frames buffered for the writer before recording drops
+BATCH_INTERVAL = 0.5               # seconds between batched writes
+CLOSE_TIMEOUT = 5.0                # seconds close() waits for the writer to finish
+
+
+class SegmentRecorder:
+    """Broadcaster listener that records frames off the streaming path.
+
+    put() only appends to a bounded queue and never blocks the camera reader;
+    if the disk cannot keep up, the recording (not the viewers) drops frames.
+    A writer thread flushes queued frames in batches, one vectored write per
+    batch for the segment and one for its index. A batch that cannot be
+    written (e.g. the SD card is full) is dropped and the next frame starts
+    a new segment, so no index points at data that is not there.
+    """
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, max_segments=MAX_SEGMENTS):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.dropped = 0
+        self.write_errors = 0
+        self._failing = False
+        self._queue = queue.Queue(maxsize=QUEUE_FRAMES)
+        self._data = None
+        self._index = None
+        self._size = 0
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._write_loop, name='recorder', daemon=True)
+        self._thread.start()
+
+    def put(self, frame):
+        try:
+            self._queue.put_nowait((frame.timestamp, frame.data))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        try:
+            self._queue.put(None, timeout=CLOSE_TIMEOUT)
+        except queue.Full:
+            log.error("Recorder writer is stuck; closing without flushing %d queued frames", self._queue.qsize())
+            return
+        self._thread.join(CLOSE_TIMEOUT)
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            batch = []
+            while item is not None:
+                batch.append(item)
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except OSError as e:
+                    self._write_failed(batch, e)
+                else:
+                    if self._failing:
+                        log.info("Recording writes succeed again")
+                    self._failing = False
+            if item is None:
+                break
+            time.sleep(BATCH_INTERVAL)
+        self._close_segment()
+
+    def _write_batch(self, batch):
+        frames, records = [], []
+        for timestamp, frame in batch:
+            if self._data is None or self._size + len(frame) > self.segment_bytes:
+                self._flush(frames, records)
+                frames, records = [], []
+                self._open_segment(timestamp)
+            records.append(INDEX_RECORD.pack(timestamp, self._size, len(frame)))
+            frames.append(frame)
+            self._size += len(frame)
+        self._flush(frames, records)
+
+    def _flush(self, frames, records):
+        if frames:
+            # Data before index: an index record must never point past the segment's end
+            _write_all(self._data, frames)
+            _write_all(self._index, records)
+
+    def _write_failed(self, batch, error):
+        self.dropped += len(batch)
+        self.write_errors += 1
+        if not self._failing:
+            log.error("Recording write failed, dropping frames until writes succeed: %s", error)
+        else:
+            log.debug("Recording write failed again: %s", error)
+        self._failing = True
+        # The segment may end in a partial frame; the next batch starts a new one
+        try:
+            self._close_segment()
+        except OSError:
+            pass
+
+    def _open_segment(self, timestamp):
+        self._close_segment()
+        base = os.path.join(self.directory, f'segment-{int(timestamp * 1000)}')
+        self._data = os.open(base + '.mjpeg', os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._index = os.open(base + '.idx', os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._size = 0
+        log.info("Recording to %s.mjpeg", base)
+        self._prune()
+
+    def _close_segment(self):
+        if self._data is not None:
+            data, index, self._data, self._index = self._data, self._index, None, None
+            try:
+                os.close(data)
+            finally:
+                os.close(index)
+
+    def _prune(self):
+        for base in list_segments(self.directory)[:-self.max_segments]:
+            log.info("Deleting old segment %s.mjpeg", base)
+            for suffix in ('.mjpeg', '.idx'):
+                try:
+                    os.unlink(base + suffix)
+                except FileNotFoundError:
+                    pass
+
+
+def _write_all(fd, buffers):
+    """os.writev() every buffer to fd, carrying on after short writes."""
+    views = [memoryview(b) for b in buffers]
+    i = 0
+    while i < len(views):
+        written = os.writev(fd, views[i:])
+        while i < len(views) and written >= len(views[i]):
+            written -= len(views[i])
+            i += 1
+        if written:
+            views[i] = views[i][written:]
+
+
+def list_segments(directory):
+    """Segment paths without extension, oldest first."""
+    paths = glob.glob(os.path.join(directory, 'segment-*.mjpeg'))
+    return sorted((p[:-len('.mjpeg')] for p in paths), key=lambda p: int(p.rsplit('-', 1)[1]))
+
+
+class _Index:
+    """Read-only sequence view of an mmap'd .idx file."""
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._count = len(buffer) // INDEX_RECORD.size
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        return INDEX_RECORD.unpack_from(self._buffer, i * INDEX_RECORD.size)
+
+
+def _map(path):
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) if size else None
+
+
+def replay_frames(directory, start_time):
+    """Yield (timestamp, frame memoryview) from start_time onward, across segments.
+
+    Each segment and its index are mmap'd, the first frame is found by binary
+    search on the index, and frames are sliced straight out of the mapping.
+    Stops once it has caught up with what has been written so far.
+    """
+    segments = list_segments(directory)
+    starts = [int(s.rsplit('-', 1)[1]) / 1000 for s in segments]
+    # Last segment that began at or before start_time (or the first one)
+    current = max([i for i, t in enumerate(starts) if t <= start_time] or [0])
+    position = None
+
+    while segments and current < len(segments):
+        base = segments[current]
+        try:
+            data, index_map = _map(base + '.mjpeg'), _map(base + '.idx')
+        except FileNotFoundError:
+            current += 1  # pruned while replaying
+            position = None
+            continue
+        if index_map is None or data is None:
+            if current + 1 < len(segments):
+                current += 1  # left empty by a failed write
+                position = None
+                continue
+            break
+        index = _Index(index_map)
+
+        if position is None:
+            lo, hi = 0, len(index)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if index[mid][0] < start_time:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            position = lo
+
+        # The mappings are left to be unmapped by refcounting: the caller
+        # may still hold the last yielded slice when we move on.
+        view = memoryview(data)
+        while position < len(index):
+            timestamp, offset, length = index[position]
+            if offset + length > len(data):
+                break  # index written ahead of the mapped data
+            yield timestamp, view[offset:offset + length]
+            position += 1
+
+        if current + 1 < len(segments):
+            current += 1
+            position = 0
+            continue
+        # Reached the newest known segment: pick up anything written meanwhile
+        newer = list_segments(directory)
+        if base in newer and os.path.getsize(base + '.idx') // INDEX_RECORD.size > position:
+            continue
+        if newer and newer[-1] != base:
+            segments = newer
+            current = segments.index(base) + 1 if base in segments else 0
+            position = 0
+            continue
+        break
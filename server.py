@@ -0,0 +1,246 @@
+"""Motor control, video and stills from one process on one port
+
+Replaces running websocket_server.py and camera_server.py side by side:
+
+    ws://<pi-ip>:8765/                control WebSocket, same commands as websocket_server.py
+    http://<pi-ip>:8765/              viewer page
+    http://<pi-ip>:8765/stream        MJPEG stream
+    http://<pi-ip>:8765/snapshot      one JPEG, ?width=&height=&quality= optional
+    http://<pi-ip>:8765/stats         stream, capture and motor status
+    http://<pi-ip>:8765/log_level     ?level=DEBUG[&logger=camera]
+
+One rpicam-vid process feeds the stream, /snapshot, the WebSocket `capture`
+command and its video topic, so a capture no longer fails because the stream
+holds the camera. The H.264 stream, per-viewer stream profiles and recording
+are still camera_server.py only.
+
+    python3 server.py                       # L298N (root) profile
+    python3 server.py --profile waveshare   # Waveshare Motor Driver HAT
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import websockets
+from websockets.asyncio.server import ServerConnection
+
+from camera import (DEFAULT_HEIGHT, DEFAULT_QUALITY, DEFAULT_WIDTH, AsyncFrameSlot, camera_status, capture_jpeg_async,
+                    subscribe_video_async, unsubscribe_video_soon, video_broadcaster)
+from mjpeg import part_header, timestamp_headers
+from utils import set_log_level
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+log = logging.getLogger(__name__)
+
+PORT = 8765  # the control server's port, so existing clients connect unchanged
+OPEN_TIMEOUT = 10  # seconds to complete the WebSocket handshake or an HTTP request; streams are exempt
+
+STREAM_WRITE_BUFFER = 64 * 1024  # bytes (about two frames) waiting to go out to a viewer before its frames are skipped
+
+# One camera process for the stream, the WebSocket video topic and every capture
+broadcaster = video_broadcaster()
+
+STREAM_HEADERS = (
+    b'HTTP/1.1 200 OK\r\n'
+    b'Content-Type: multipart/x-mixed-replace; boundary=frame\r\n'
+    b'Cache-Control: no-cache, no-store, must-revalidate\r\n'
+    b'Connection: close\r\n'
+    b'\r\n'
+)
+
+VIEWER_PAGE = b'''<!DOCTYPE html>
+<html>
+<head><title>Pi Camera Stream</title></head>
+<body style="margin:0;background:#000;display:flex;justify-content:center;align-items:center;height:100vh;">
+    <img src="/stream" style="max-width:100%;max-height:100%;">
+</body>
+</html>'''
+
+profile_server = None  # the profile's websocket_server module, imported by load_profile()
+
+
+class Connection(ServerConnection):
+    """ServerConnection whose opening handshake may turn into a stream that lasts as long as it is watched.
+
+    websockets' open_timeout also covers process_request, where the MJPEG
+    stream runs, so it is disabled and OPEN_TIMEOUT applied here instead:
+    the connection is dropped unless the handshake completes in time or
+    the request turns into a stream, which calls keep_open(). `peer_gone`
+    turns True once the client has hung up.
+    """
+
+    peer_gone = False
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        self._open_timer = asyncio.get_running_loop().call_later(OPEN_TIMEOUT, transport.abort)
+
+    def keep_open(self):
+        self._open_timer.cancel()
+
+    async def handshake(self, *args, **kwargs):
+        try:
+            await super().handshake(*args, **kwargs)
+        finally:
+            self._open_timer.cancel()
+
+    def eof_received(self):
+        self.peer_gone = True
+        return super().eof_received()
+
+    def connection_lost(self, exc):
+        self.peer_gone = True
+        self._open_timer.cancel()
+        super().connection_lost(exc)
+
+
+def load_profile(name):
+    """Import the websocket_server of a hardware profile; its config and motor driver come with it."""
+    global profile_server
+    if name == 'waveshare':
+        sys.path.insert(0, os.path.join(_HERE, 'waveshare_hat'))
+    import websocket_server  # also sets up logging
+    profile_server = websocket_server
+    return websocket_server
+
+
+def respond(connection, status, content_type, body):
+    """HTTP response with a body of any type (connection.respond() only makes text/plain)."""
+    response = connection.respond(status, '')
+    del response.headers['Content-Type'], response.headers['Content-Length']
+    response.headers['Content-Type'] = content_type
+    response.headers['Content-Length'] = str(len(body))
+    response.body = body
+    return response
+
+
+def respond_json(connection, body):
+    return respond(connection, 200, 'application/json', json.dumps(body, indent=2).encode())
+
+
+async def http_request(connection, request):
+    """process_request hook: answers plain HTTP requests, lets WebSocket upgrades through to the control handler."""
+    if request.headers.get('Upgrade', '').lower() == 'websocket':
+        return None
+
+    url = urlsplit(request.path)
+    query = parse_qs(url.query)
+    log.debug("%s - GET %s", connection.remote_address[0], request.path)
+
+    if url.path == '/':
+        return respond(connection, 200, 'text/html', VIEWER_PAGE)
+
+    elif url.path == '/stream':
+        return await stream_mjpeg(connection)
+
+    elif url.path == '/snapshot':
+        try:
+            width, height, quality = (int(query.get(name, [default])[0]) for name, default in
+                                      (('width', DEFAULT_WIDTH), ('height', DEFAULT_HEIGHT), ('quality', DEFAULT_QUALITY)))
+        except ValueError:
+            return connection.respond(400, "width, height and quality must be numbers\n")
+        result = await capture_jpeg_async(width=width, height=height, quality=quality)
+        if not result['success']:
+            return connection.respond(503, f"{result['error']}\n")
+        return respond(connection, 200, 'image/jpeg', result['jpeg'])
+
+    elif url.path == '/stats':
+        return respond_json(connection, {
+            'viewers': broadcaster.viewers,
+            # Writes here never block, so only camera_server.py has a 'write' stage to report
+            'stages': {stage: summary for stage, summary in broadcaster.stats.summary().items() if stage != 'write'},
+            'camera': camera_status(),
+            'clients': len(profile_server.clients),
+            'motors': profile_server.warmup.summary(),
+        })
+
+    elif url.path == '/log_level':
+        logger = query.get('logger', [None])[0]
+        try:
+            level = set_log_level(query.get('level', [None])[0], logger)
+        except ValueError as e:
+            return connection.respond(400, f"{e}\n")
+        return respond_json(connection, {'logger': logger or 'root', 'level': level})
+
+    return connection.respond(404, "Not Found\n")
+
+
+async def stream_mjpeg(connection):
+    """Send the MJPEG stream on the connection's transport until the viewer leaves.
+
+    process_request cannot return a response that never ends, so the stream
+    is written to the transport here and the connection closed afterwards;
+    the WebSocket handshake then finds it closed and sends nothing. A frame
+    is skipped while more than STREAM_WRITE_BUFFER bytes are still waiting
+    to go out, so a slow viewer gets the newest frame once it catches up.
+    """
+    # Claiming the camera can take a while; it happens on the capture worker pool, not this loop
+    connection.keep_open()
+    slot = await subscribe_video_async(AsyncFrameSlot())
+    if broadcaster.error is not None and broadcaster.viewers == 0:
+        unsubscribe_video_soon(slot)
+        return connection.respond(503, f"{broadcaster.error}\n")
+
+    transport = connection.transport
+    record = broadcaster.stats.record
+    address = connection.remote_address[0]
+    skipped = 0
+    log.info("Viewer connected: %s", address)
+
+    transport.write(STREAM_HEADERS)
+    try:
+        while True:
+            frame = await slot.get()
+            if frame is None or connection.peer_gone:
+                break
+            if transport.get_write_buffer_size() > STREAM_WRITE_BUFFER:
+                skipped += 1
+                continue
+            record('queue', time.monotonic() - frame.parsed_at)
+            transport.writelines([part_header(len(frame.data), extra=timestamp_headers(frame.timestamp)),
+                                  frame.data, b'\r\n'])
+    finally:
+        unsubscribe_video_soon(slot)
+        log.info("Viewer left: %s (%d frames dropped, %d skipped while behind)", address, slot.dropped, skipped)
+    transport.abort()
+    await connection.wait_closed()
+
+
+async def main(port=PORT):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    # open_timeout=None: Connection applies OPEN_TIMEOUT itself, except to MJPEG streams
+    async with websockets.serve(profile_server.handle_client, '0.0.0.0', port, create_connection=Connection,
+                                process_request=http_request, open_timeout=None):
+        log.info("Control WebSocket at ws://0.0.0.0:%d/, viewer at http://0.0.0.0:%d/", port, port)
+        # Already accepting connections; the motors come up in the background
+        motors = asyncio.create_task(profile_server.start_motors())
+        await stop.wait()
+        log.info("Shutting down...")
+        # Closing the camera ends every stream, so the server can close
+        broadcaster.close()
+    await motors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Control WebSocket, MJPEG stream and snapshots on one port")
+    parser.add_argument('--profile', choices=('l298n', 'waveshare'), default='l298n',
+                        help="hardware profile (default: l298n, the root-level code)")
+    parser.add_argument('--port', type=int, default=PORT, help=f"port (default: {PORT})")
+    args = parser.parse_args()
+
+    load_profile(args.profile)
+    try:
+        asyncio.run(main(args.port))
+    finally:
+        profile_server.shutdown()
@@ -0,0 +1,127 @@
+"""Simulated RPi.GPIO for running the L298N controller off the car
+
+Has the functions and constants motor_controller.py and pwm.py use, plus
+the edge detection waveshare_hat/sensors.py reads its encoders with;
+set_input() drives an input pin as the encoder would. Every
+call is recorded in `calls` as (time.perf_counter(), function, args) and
+counted in `transactions` and `counts`; set `latency` (seconds) to make each
+call take that long, like a slow pin driver. Output levels are remembered,
+so input() reads back what was written, as on the real pins.
+
+Selected with CAR_SIMULATE=1 (see config.py); CAR_SIM_LATENCY_US sets
+`latency` for the L298N profile.
+"""
+import collections
+import time
+
+BCM, BOARD = 11, 10
+OUT, IN = 0, 1
+LOW, HIGH = 0, 1
+PUD_OFF, PUD_DOWN, PUD_UP = 20, 21, 22
+RISING, FALLING, BOTH = 31, 32, 33
+
+CALL_LOG_SIZE = 100_000  # most recent calls kept in `calls`
+
+latency = 0.0
+calls = collections.deque(maxlen=CALL_LOG_SIZE)
+counts = collections.Counter()  # calls per function name
+transactions = 0                 # all calls, including those no longer in `calls`
+
+_levels = {}
+_callbacks = {}
+
+
+def _record(function, *args):
+    global transactions
+    transactions += 1
+    counts[function] += 1
+    calls.append((time.perf_counter(), function, args))
+    if latency:
+        time.sleep(latency)
+
+
+def _pins(channel):
+    return list(channel) if isinstance(channel, (list, tuple)) else [channel]
+
+
+def reset():
+    """Forget all pin state and recorded calls."""
+    global transactions
+    transactions = 0
+    calls.clear()
+    counts.clear()
+    _levels.clear()
+    _callbacks.clear()
+
+
+def setmode(mode):
+    _record('setmode', mode)
+
+
+def setwarnings(flag):
+    _record('setwarnings', flag)
+
+
+def setup(channel, direction, pull_up_down=PUD_OFF, initial=None):
+    _record('setup', channel, direction)
+    for pin in _pins(channel):
+        _levels.setdefault(pin, initial if initial is not None else LOW)
+
+
+def output(channel, value):
+    _record('output', channel, value)
+    pins = _pins(channel)
+    values = list(value) if isinstance(value, (list, tuple)) else [value] * len(pins)
+    for pin, level in zip(pins, values):
+        _levels[pin] = HIGH if level else LOW
+
+
+def input(channel):
+    _record('input', channel)
+    return _levels.get(channel, LOW)
+
+
+def add_event_detect(channel, edge, callback=None, bouncetime=None):
+    _record('add_event_detect', channel, edge)
+    _callbacks[channel] = callback
+
+
+def remove_event_detect(channel):
+    _record('remove_event_detect', channel)
+    _callbacks.pop(channel, None)
+
+
+def set_input(channel, level):
+    """Drive an input pin from the simulation side, firing its edge callback on a change."""
+    if _levels.get(channel) != level:
+        _levels[channel] = level
+        callback = _callbacks.get(channel)
+        if callback is not None:
+            callback(channel)
+
+
+def cleanup(channel=None):
+    _record('cleanup', channel)
+
+
+class PWM:
+    def __init__(self, channel, frequency):
+        _record('PWM', channel, frequency)
+        self.channel = channel
+        self.frequency = frequency
+        self.duty = 0
+
+    def start(self, duty):
+        _record('PWM.start', self.channel, duty)
+        self.duty = duty
+
+    def ChangeDutyCycle(self, duty):
+        _record('PWM.ChangeDutyCycle', self.channel, duty)
+        self.duty = duty
+
+    def ChangeFrequency(self, frequency):
+        _record('PWM.ChangeFrequency', self.channel, frequency)
+        self.frequency = frequency
+
+    def stop(self):
+        _record('PWM.stop', self.channel)
@@ -0,0 +1,127 @@
+"""Background hardware bring-up for the WebSocket servers
+
+The servers start listening first and bring the motors up here, on a worker
+thread: build the MotorController, then run its diagnostic unless a passing
+result for the same setup is cached on disk. Until that is done, motion
+commands are answered with a "warming_up" status instead of waiting.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+log = logging.getLogger(__name__)
+
+STARTED = time.monotonic()  # server start, near enough: the servers import this early
+
+WARMING_UP = 'warming_up'
+READY = 'ready'
+FAILED = 'failed'
+
+
+def fingerprint(paths, settings=None):
+    """Hash of the files and runtime settings that decide whether a cached diagnostic still holds."""
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode())
+    for path in paths:
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def load_cached(cache_path, key):
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return cached.get('results') if cached.get('fingerprint') == key else None
+
+
+def save_cached(cache_path, key, results):
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temporary = cache_path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'fingerprint': key, 'saved': time.time(), 'results': results}, f)
+        os.replace(temporary, cache_path)
+    except OSError as e:
+        log.warning("Could not cache diagnostic results in %s: %s", cache_path, e)
+
+
+class HardwareWarmup:
+    """Creates the motor controller with factory() and diagnoses it, off the event loop.
+
+    The diagnostic is skipped when cache_path holds a passing result saved
+    with the same fingerprint of fingerprint_paths (the profile's config and
+    driver sources) and settings (e.g. whether the hardware is simulated,
+    which the sources do not show); with force_diagnose it always runs. A result with
+    'ok': False is never cached, so a failing setup is checked again on the
+    next start.
+    """
+
+    def __init__(self, factory, cache_path, fingerprint_paths, force_diagnose=False, settings=None):
+        self.factory = factory
+        self.cache_path = cache_path
+        self.fingerprint_paths = fingerprint_paths
+        self.settings = settings
+        self.force_diagnose = force_diagnose
+        self.state = WARMING_UP
+        self.motor = None
+        self.diagnostics = None
+        self.diagnostics_cached = False
+        self.error = None
+        self.seconds = None
+        self.first_connection = None  # seconds from STARTED to the first accepted connection
+
+    async def run(self):
+        """Bring the hardware up; returns the motor controller, or None if that failed."""
+        started = time.monotonic()
+        try:
+            await asyncio.to_thread(self._bring_up)
+        except Exception as e:
+            log.exception("Hardware bring-up failed")
+            self.state, self.error = FAILED, str(e)
+            return None
+        finally:
+            self.seconds = time.monotonic() - started
+        self.state = READY
+        log.info("Motors ready after %.2f s (diagnostic %s)",
+                 self.seconds, 'cached' if self.diagnostics_cached else 'run')
+        return self.motor
+
+    def _bring_up(self):
+        self.motor = self.factory()
+        key = fingerprint(self.fingerprint_paths, self.settings)
+        cached = None if self.force_diagnose else load_cached(self.cache_path, key)
+        if cached is not None:
+            log.info("Skipping startup motor diagnostic: nothing changed since it last passed")
+            self.diagnostics, self.diagnostics_cached = cached, True
+            return
+        log.info("Running startup motor diagnostic...")
+        self.diagnostics = self.motor.diagnose()
+        if self.diagnostics.get('ok', True):
+            save_cached(self.cache_path, key, self.diagnostics)
+
+    def connection_accepted(self):
+        if self.first_connection is None:
+            self.first_connection = time.monotonic() - STARTED
+            log.info("First connection accepted %.3f s after start (motors %s)", self.first_connection, self.state)
+
+    def not_ready(self, command):
+        """Reply for a command that needs the motors before they are up."""
+        if self.state == FAILED:
+            return {'status': 'error', 'command': command, 'message': f'motor setup failed: {self.error}'}
+        return {'status': WARMING_UP, 'command': command}
+
+    def summary(self):
+        return {
+            'state': self.state,
+            'seconds': None if self.seconds is None else round(self.seconds, 3),
+            'diagnostics': self.diagnostics,
+            'diagnostics_cached': self.diagnostics_cached,
+            'error': self.error,
+            'first_connection_s': None if self.first_connection is None else round(self.first_connection, 3),
+        }
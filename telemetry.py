@@ -0,0 +1,127 @@
+"""Telemetry topic for WebSocket clients
+
+A TelemetryPublisher takes a snapshot of the car at a fixed rate and sends
+it to every subscribed connection. Each snapshot is serialized once and the
+same string goes to all subscribers. A subscriber that is still sending the
+previous snapshot gets only the newest one when it is ready again; stale
+snapshots are dropped, never queued.
+"""
+import asyncio
+import json
+import logging
+import sys
+import time
+
+from websockets.exceptions import ConnectionClosed
+
+log = logging.getLogger(__name__)
+
+DEFAULT_RATE_HZ = 5
+
+
+class RateCounter:
+    """Counts events; rate() returns events per second since the previous rate() call."""
+
+    def __init__(self):
+        self.total = 0
+        self._last_total = 0
+        self._last_time = time.monotonic()
+
+    def add(self, count=1):
+        self.total += count
+
+    def rate(self):
+        now = time.monotonic()
+        elapsed = now - self._last_time
+        rate = (self.total - self._last_total) / elapsed if elapsed > 0 else 0.0
+        self._last_total, self._last_time = self.total, now
+        return rate
+
+
+def camera_status():
+    """Capture session and cache state, without importing camera (and starting its workers) if unused."""
+    camera = sys.modules.get('camera')
+    if camera is None:
+        return {'open': False}
+    return camera.camera_status()
+
+
+class _Subscriber:
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.pending = None  # newest snapshot not yet sent
+        self.ready = asyncio.Event()
+        self.sent = 0
+        self.dropped = 0
+        self.task = asyncio.create_task(self._send_loop())
+
+    def offer(self, payload):
+        if self.pending is not None:
+            self.dropped += 1
+        self.pending = payload
+        self.ready.set()
+
+    async def _send_loop(self):
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                payload, self.pending = self.pending, None
+                # send() waits while the connection's write buffer is full; snapshots
+                # published meanwhile replace each other in `pending`
+                await self.websocket.send(payload)
+                self.sent += 1
+        except ConnectionClosed:
+            pass
+
+
+class TelemetryPublisher:
+    """Publishes snapshot() as a 'telemetry' message to subscribers rate_hz times a second.
+
+    snapshot() runs on the event loop and must return a JSON-serializable
+    dict; nothing is computed while nobody is subscribed.
+    """
+
+    def __init__(self, snapshot, rate_hz=DEFAULT_RATE_HZ):
+        self.snapshot = snapshot
+        self.rate_hz = rate_hz
+        self.seq = 0
+        self._subscribers = {}
+        self._task = None
+
+    def subscribe(self, websocket):
+        if websocket not in self._subscribers:
+            self._subscribers[websocket] = _Subscriber(websocket)
+            if self._task is None:
+                self._task = asyncio.create_task(self._run())
+
+    def unsubscribe(self, websocket):
+        subscriber = self._subscribers.pop(websocket, None)
+        if subscriber is not None:
+            subscriber.task.cancel()
+
+    def stats(self):
+        return {
+            'rate_hz': self.rate_hz,
+            'snapshots': self.seq,
+            'subscribers': [{'sent': s.sent, 'dropped': s.dropped} for s in self._subscribers.values()],
+        }
+
+    async def _run(self):
+        period = 1.0 / self.rate_hz
+        next_tick = time.monotonic()
+        while True:
+            now = time.monotonic()
+            next_tick = max(next_tick + period, now)  # after a stall, carry on rather than catch up
+            await asyncio.sleep(next_tick - now)
+            if not self._subscribers:
+                continue
+            self.seq += 1
+            try:
+                payload = json.dumps({'status': 'ok', 'command': 'telemetry', 'seq': self.seq,
+                                      'time': round(time.time(), 3), **self.snapshot()})
+            except Exception:
+                log.exception("Telemetry snapshot failed")
+                continue
+            for subscriber in self._subscribers.values():
+                subscriber.offer(payload)
@@ -0,0 +1,177 @@
+"""Helpers shared by the servers"""
+import atexit
+import collections
+import json
+import logging
+import logging.handlers
+import math
+import os
+import queue
+import struct
+import time
+
+log = logging.getLogger(__name__)
+
+_HEADER_LENGTH = struct.Struct('!I')
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+LOG_DATEFMT = "%H:%M:%S"
+
+STATS_WINDOW = 1000  # most recent samples kept per stage
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def binary_message(header, payload):
+    """Frame a payload for a binary WebSocket message.
+
+    Layout: 4-byte big-endian header length, UTF-8 JSON header, payload.
+    Returned as a list of fragments so the payload is never concatenated
+    with the header; websockets sends the list as one fragmented message.
+    """
+    encoded = json.dumps(header, separators=(',', ':')).encode()
+    return [_HEADER_LENGTH.pack(len(encoded)) + encoded, payload]
+
+
+def joystick_to_duty(x, y, speed, dead_zone):
+    """Tank-drive (left, right) motor duties for a stick position.
+
+    x and y are clamped to -1..1 (right / forward positive); a stick within
+    dead_zone of the center is treated as centered. Duties are scaled by
+    speed, so they range from -speed to speed. Raises ValueError for a NaN
+    or infinite x or y, which clamping would otherwise turn into full duty.
+    """
+    x, y = float(x), float(y)
+    if not (math.isfinite(x) and math.isfinite(y)):
+        raise ValueError(f"x and y must be finite, got {x} and {y}")
+    x = max(-1.0, min(1.0, x))
+    y = max(-1.0, min(1.0, y))
+    if math.hypot(x, y) < dead_zone:
+        x, y = 0.0, 0.0
+    left = max(-1.0, min(1.0, y + x))
+    right = max(-1.0, min(1.0, y - x))
+    return left * speed, right * speed
+
+
+class LatencyStats:
+    """Rolling latency samples per named stage, summarized on demand.
+
+    record() is a deque append, cheap enough for per-frame hot paths and safe
+    to call from several threads; percentiles and the histogram are only
+    computed when summary() is asked for.
+    """
+
+    def __init__(self, stages, window=STATS_WINDOW):
+        self._samples = {stage: collections.deque(maxlen=window) for stage in stages}
+
+    def record(self, stage, seconds):
+        self._samples[stage].append(seconds)
+
+    def summary(self):
+        result = {}
+        for stage, samples in self._samples.items():
+            values = sorted(samples)
+            if not values:
+                result[stage] = {'count': 0}
+                continue
+            pick = lambda pct: round(values[min(len(values) - 1, int(len(values) * pct / 100))] * 1000, 2)
+            histogram = collections.Counter()
+            for value in values:
+                ms = value * 1000
+                histogram[next((f'<{b}' for b in HISTOGRAM_BUCKETS_MS if ms < b),
+                               f'>={HISTOGRAM_BUCKETS_MS[-1]}')] += 1
+            result[stage] = {
+                'count': len(values),
+                'p50_ms': pick(50),
+                'p90_ms': pick(90),
+                'p99_ms': pick(99),
+                'max_ms': round(values[-1] * 1000, 2),
+                'histogram_ms': dict(histogram),
+            }
+        return result
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queues records as they are; the stock QueueHandler formats the message in the caller.
+
+    Arguments are then formatted later on the listener thread, so a record
+    shows a mutable argument as it is when written, not when logged.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level=logging.INFO):
+    """Log through a queue: callers only enqueue, a background thread formats and writes to stderr.
+
+    CAR_LOG_LEVEL, if set, overrides level (any case, like set_log_level;
+    an unknown name is logged and ignored). Queued records are flushed at
+    exit. Returns the QueueListener.
+    """
+    records = queue.SimpleQueue()
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATEFMT))
+    listener = logging.handlers.QueueListener(records, stream)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(records))
+    root.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+
+    override = os.environ.get('CAR_LOG_LEVEL')
+    if override:
+        try:
+            set_log_level(override)
+        except ValueError:
+            log.warning("Ignoring CAR_LOG_LEVEL=%s: unknown log level", override)
+    return listener
+
+
+def set_log_level(level=None, logger=None):
+    """Change a logger's level at runtime (the root logger by default); returns its effective level name.
+
+    With level None nothing changes. Raises ValueError for an unknown level name.
+    """
+    target = logging.getLogger(logger)
+    if level is not None:
+        try:
+            target.setLevel(str(level).upper())
+        except (TypeError, ValueError):
+            raise ValueError(f"unknown log level: {level}")
+    return logging.getLevelName(target.getEffectiveLevel())
+
+
+class LogSummary:
+    """Counts repetitive events and logs them as one line per interval instead of a line each.
+
+    count() is a Counter increment plus a clock check; the summary line is
+    written by the first count() after the interval is up (or by flush()),
+    so nothing is logged while nothing happens.
+    """
+
+    def __init__(self, logger, label, interval=1.0, level=logging.INFO):
+        self.logger = logger
+        self.label = label
+        self.interval = interval
+        self.level = level
+        self._counts = collections.Counter()
+        self._since = time.monotonic()
+
+    def count(self, key):
+        now = time.monotonic()
+        if not self._counts:
+            self._since = now  # an interval starts with its first event, not after the last summary
+        self._counts[key] += 1
+        if now - self._since >= self.interval:
+            self.flush()
+
+    def flush(self):
+        now = time.monotonic()
+        if self._counts:
+            self.logger.log(self.level, "%s in the last %.1f s: %s", self.label, now - self._since,
+                            ', '.join(f'{key} {count}' for key, count in self._counts.most_common()))
+            self._counts.clear()
+        self._since = now
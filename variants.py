@@ -0,0 +1,113 @@
+"""Per-profile variants of stream frames, built once and shared by every viewer
+
+A profile is a (width, quality) pair. The first viewer that needs a source
+frame at a given profile decodes, downscales and re-encodes it; every other
+viewer on the same profile gets the same bytes.
+
+Scaling needs Pillow (`pip install pillow`, or `python3-pil` on Raspberry Pi
+OS). Without it, viewers get the source frames unchanged.
+"""
+import io
+import logging
+import threading
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+log = logging.getLogger(__name__)
+
+MIN_WIDTH = 80
+MIN_QUALITY = 10
+MAX_QUALITY = 95
+
+
+def reencode(frame, width, height, quality):
+    """Decode a JPEG, scale it to width x height and encode it again at quality (Pillow required)."""
+    image = Image.open(io.BytesIO(frame))
+    # draft() lets libjpeg decode straight at 1/2, 1/4 or 1/8 scale
+    image.draft('RGB', (width, height))
+    if image.size != (width, height):
+        image = image.resize((width, height), Image.BILINEAR)
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=quality)
+    return out.getvalue()
+
+
+class StreamProfile:
+    """What one viewer asked for, clamped to what the source stream can give."""
+
+    def __init__(self, source_width, source_height, source_fps, width=None, quality=None, fps=None):
+        width = source_width if width is None else max(MIN_WIDTH, min(source_width, int(width)))
+        self.width = width - width % 16  # round so near-identical requests share a variant
+        self.height = round(source_height * self.width / source_width)
+        self.quality = None if quality is None else max(MIN_QUALITY, min(MAX_QUALITY, int(quality)))
+        self.fps = source_fps if fps is None else max(1.0, min(float(source_fps), float(fps)))
+        self.key = None if self.width == source_width and self.quality is None else (self.width, self.quality)
+
+    def __repr__(self):
+        quality = f" q={self.quality}" if self.quality else ""
+        return f"{self.width}x{self.height}{quality} @{self.fps:g}fps"
+
+
+class _Variant:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.source = None
+        self.data = None
+        self.viewers = 0
+
+
+class VariantCache:
+    """Latest variant of the current source frame for each profile in use."""
+
+    def __init__(self, default_quality=80):
+        self.default_quality = default_quality
+        self._lock = threading.Lock()
+        self._variants = {}
+        self.built = 0
+        self.shared = 0
+        if Image is None:
+            log.warning("Pillow not installed — stream width/quality requests will get the source frames")
+
+    def acquire(self, profile):
+        if profile.key is None:
+            return
+        with self._lock:
+            variant = self._variants.get(profile.key)
+            if variant is None:
+                variant = self._variants[profile.key] = _Variant()
+            variant.viewers += 1
+
+    def release(self, profile):
+        """Drop a profile's variant once its last viewer has left."""
+        if profile.key is None:
+            return
+        with self._lock:
+            variant = self._variants[profile.key]
+            variant.viewers -= 1
+            if not variant.viewers:
+                del self._variants[profile.key]
+
+    def get(self, frame, profile):
+        """Return frame as seen through an acquired profile, building it at most once per source frame."""
+        if profile.key is None or Image is None:
+            return frame
+
+        variant = self._variants[profile.key]
+        with variant.lock:
+            if variant.source is frame:
+                self.shared += 1
+                return variant.data
+            try:
+                variant.data = self._build(frame, profile)
+            except OSError as e:
+                log.warning("Could not build %s variant (%s) — sending source frame", profile, e)
+                variant.data = frame
+            variant.source = frame
+            self.built += 1
+            return variant.data
+
+    def _build(self, frame, profile):
+        return reencode(frame, profile.width, profile.height, profile.quality or self.default_quality)
@@ -0,0 +1,127 @@
+"""Video topic for WebSocket clients
+
+A subscribed connection gets the camera's JPEG frames as binary messages
+(utils.binary_message layout, header command "video") on the same
+connection as its motion commands. Before each frame the connection's send
+queue is measured: the server's write buffer plus what the kernel has not
+got delivered yet. While that is over MAX_QUEUED_BYTES the frame is skipped,
+so an ack or any other reply waits behind at most one frame and that much
+more, never a growing backlog.
+"""
+import asyncio
+import json
+import logging
+import time
+
+from websockets.exceptions import ConnectionClosed
+
+from mjpeg import queued_bytes
+from utils import binary_message
+
+log = logging.getLogger(__name__)
+
+MAX_QUEUED_BYTES = 16 * 1024  # undelivered bytes on a connection above which its frames are skipped
+
+
+def send_queue_depth(websocket):
+    """Bytes sent on websocket that have not reached the peer yet: asyncio's write buffer plus the kernel's."""
+    transport = websocket.transport
+    sock = transport.get_extra_info('socket')
+    return transport.get_write_buffer_size() + (queued_bytes(sock) if sock is not None else 0)
+
+
+class _Viewer:
+    def __init__(self, websocket, broadcaster, slot, unsubscribe, fps, on_stop):
+        self.websocket = websocket
+        self.broadcaster = broadcaster
+        self.slot = slot
+        self._unsubscribe = unsubscribe
+        self.fps = fps
+        self.sent = 0
+        self.skipped = 0  # frames the connection was too far behind for
+        self._on_stop = on_stop
+        self._next_due = 0.0
+        self.task = asyncio.create_task(self._send_loop())
+
+    def close(self):
+        # The slot is released here as well: a task cancelled before it ever ran skips its finally
+        self.task.cancel()
+        self._unsubscribe(self.slot)
+
+    async def _send_loop(self):
+        websocket = self.websocket
+        period = 1.0 / self.fps
+        try:
+            while True:
+                frame = await self.slot.get()
+                if frame is None:
+                    await websocket.send(json.dumps({'status': 'error', 'command': 'video',
+                                                     'message': self.broadcaster.error or 'camera stopped'}))
+                    break
+                now = time.monotonic()
+                if now < self._next_due - period / 4:  # a little early is camera jitter, not too soon
+                    continue
+                if send_queue_depth(websocket) > MAX_QUEUED_BYTES:
+                    self.skipped += 1
+                    continue
+                header = {
+                    'status': 'ok',
+                    'command': 'video',
+                    'format': 'jpeg',
+                    'size': len(frame.data),
+                    'timestamp': round(frame.timestamp, 6),
+                }
+                # One unfragmented message: while a fragmented one is being sent,
+                # websockets holds every other send on the connection back
+                await websocket.send(b''.join(binary_message(header, frame.data)))
+                self.sent += 1
+                self._next_due = max(self._next_due + period, now)
+        except ConnectionClosed:
+            pass
+        finally:
+            self._unsubscribe(self.slot)
+            self._on_stop(self)
+
+
+class VideoPublisher:
+    """Sends live camera frames to subscribed connections, each at most at the rate it asked for."""
+
+    def __init__(self):
+        self._viewers = {}
+
+    async def subscribe(self, websocket, fps=None):
+        """Start sending frames to websocket; returns the frame rate it will get at most.
+
+        Raises ValueError if fps is not a number. Subscribing again changes
+        the rate. The camera is claimed on the capture worker pool, so other
+        commands keep being handled meanwhile.
+        """
+        # Imported on first use, not at startup
+        from camera import (VIDEO_FRAMERATE, AsyncFrameSlot, subscribe_video_async, unsubscribe_video_soon,
+                            video_broadcaster)
+
+        try:
+            fps = VIDEO_FRAMERATE if fps is None else max(1.0, min(float(VIDEO_FRAMERATE), float(fps)))
+        except (TypeError, ValueError):
+            raise ValueError(f"fps must be a number, got {fps!r}")
+        self.unsubscribe(websocket)
+        slot = await subscribe_video_async(AsyncFrameSlot())
+        self._viewers[websocket] = _Viewer(websocket, video_broadcaster(), slot, unsubscribe_video_soon, fps,
+                                           self._stopped)
+        log.info("Video subscriber %s at up to %g fps", websocket.remote_address, fps)
+        return fps
+
+    def unsubscribe(self, websocket):
+        viewer = self._viewers.pop(websocket, None)
+        if viewer is not None:
+            viewer.close()
+
+    def stats(self):
+        return {
+            'subscribers': [{'fps': v.fps, 'sent': v.sent, 'skipped': v.skipped, 'dropped': v.slot.dropped}
+                            for v in self._viewers.values()],
+        }
+
+    def _stopped(self, viewer):
+        if self._viewers.get(viewer.websocket) is viewer:
+            del self._viewers[viewer.websocket]
@@ -0,0 +1,180 @@
+"""I2C cost of motor commands on the Waveshare HAT, measured against the simulated SMBus
+
+Runs anywhere, no HAT, I2C bus or smbus2 needed (see sim_smbus.py):
+
+    cd waveshare_hat
+    python3 benchmark.py i2c
+    python3 benchmark.py worker       # caller latency with and without the I2C worker
+    python3 benchmark.py suite        # cmds/s, transactions and p50/p99 for drive, stop, joystick
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import time
+
+from config import AIN1, AIN2, BIN1, BIN2, JOYSTICK_DEAD_ZONE, PWMA, PWMB
+from motor_controller import MotorController
+from pca9685 import PCA9685
+from sim_smbus import SMBus
+
+# joystick_to_duty lives in the shared utils.py one level up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import joystick_to_duty
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def bus_time_us(transactions, nbytes, clock_hz):
+    """Time on the wire: 9 clocks per byte (8 bits + ACK) plus a start and stop per transaction."""
+    return (nbytes * 9 + transactions * 2) / clock_hz * 1e6
+
+
+def per_channel_drive(pca, left, right):
+    """drive() as it was before bulk writes: one transaction per channel, always sent."""
+    for in1, in2, pwm, duty in ((AIN1, AIN2, PWMA, left), (BIN1, BIN2, PWMB, right)):
+        pca.invalidate()
+        pca.set_digital(in1, duty >= 0)
+        pca.set_digital(in2, duty < 0)
+        pca.set_duty_cycle(pwm, abs(duty))
+
+
+def measure(bus, name, command, repeat):
+    transactions, nbytes = bus.transactions, bus.bytes
+    started = time.perf_counter()
+    for i in range(repeat):
+        command(i)
+    elapsed = time.perf_counter() - started
+    transactions = (bus.transactions - transactions) / repeat
+    nbytes = (bus.bytes - nbytes) / repeat
+    print(f"{name:<22} {transactions:>5.1f} tx {nbytes:>6.1f} B "
+          f"{bus_time_us(transactions, nbytes, 100_000):>7.0f} us @100k "
+          f"{bus_time_us(transactions, nbytes, 400_000):>6.0f} us @400k "
+          f"{elapsed / repeat * 1e6:>6.1f} us python")
+
+
+def i2c(repeat):
+    bus = SMBus()
+    motor = MotorController(PCA9685(bus=bus), i2c_worker=False)
+    speeds = [(80, 80), (-60, 40), (30, -90), (0, 0)]
+
+    print(f"{'command':<22} {'per call':>24}")
+    measure(bus, "drive, per channel", lambda i: per_channel_drive(motor.pca, *speeds[i % 4]), repeat)
+    measure(bus, "drive, bulk", lambda i: (motor.pca.invalidate(), motor.drive(*speeds[i % 4])), repeat)
+    measure(bus, "drive, changing", lambda i: motor.drive(*speeds[i % 4]), repeat)
+    # A held joystick: same direction, duty wobbling by a percent or two
+    measure(bus, "drive, held stick", lambda i: motor.drive(70 + i % 3, 70 - i % 2), repeat)
+    measure(bus, "drive, repeated", lambda i: motor.drive(80, 80), repeat)
+    measure(bus, "stop", lambda i: motor.stop(), repeat)
+    measure(bus, "emergency_stop", lambda i: motor.emergency_stop(), repeat)
+    print("shadow registers:", motor.pca.stats())
+
+
+def worker(repeat, clock_hz, interval):
+    """How long drive() holds its caller, and what reaches the bus, with and without the worker."""
+    speeds = [(80, 80), (-60, 40), (30, -90), (60, 60)]
+    print(f"fake bus at {clock_hz // 1000} kHz, {repeat} drive() calls {interval * 1e3:g} ms apart, then stop()")
+    for use_worker in (False, True):
+        bus = SMBus(clock_hz=clock_hz)
+        motor = MotorController(PCA9685(bus=bus), i2c_worker=use_worker)
+        transactions = bus.transactions
+        waits = []
+        for i in range(repeat):
+            started = time.perf_counter()
+            motor.drive(*speeds[i % 4])
+            waits.append(time.perf_counter() - started)
+            time.sleep(interval)
+        started = time.perf_counter()
+        future = motor.stop()
+        if future is not None:
+            future.result()
+        stop_ms = (time.perf_counter() - started) * 1e3
+        motor.cleanup()
+        waits.sort()
+        name = "worker" if use_worker else "direct"
+        print(f"{name:<7} drive() p50 {statistics.median(waits) * 1e6:>7.1f} us  "
+              f"p99 {waits[int(len(waits) * 0.99)] * 1e6:>7.1f} us  "
+              f"stop on the bus after {stop_ms:5.2f} ms  "
+              f"{(bus.transactions - transactions) / repeat:4.2f} tx per drive()")
+        if use_worker:
+            print("        worker:", motor.worker.stats())
+
+
+def measure_commands(name, command, count, transactions, prepare=None):
+    """Time count calls of command(i); prepare(i), if given, runs untimed before each one."""
+    samples = []
+    total = 0
+    for i in range(count):
+        if prepare is not None:
+            prepare(i)
+        before = transactions()
+        started = time.perf_counter()
+        command(i)
+        samples.append(time.perf_counter() - started)
+        total += transactions() - before
+    print(f"{name:<10} {count / sum(samples):>9.0f} cmds/s  {total / count:5.2f} tx/cmd  "
+          f"p50 {percentile(samples, 50) * 1e6:8.1f} us  p99 {percentile(samples, 99) * 1e6:8.1f} us")
+
+
+def suite(count, latency_us, clock_hz, use_worker):
+    """Throughput, I2C transactions and latency per command on the simulated bus.
+
+    `joystick` is the server's handler work (parse, joystick_to_duty) plus
+    the drive() the control loop makes from it. With the worker, each
+    command is timed until its write is on the bus.
+    """
+    bus = SMBus(latency=latency_us / 1e6, clock_hz=clock_hz)
+    motor = MotorController(PCA9685(bus=bus), i2c_worker=use_worker)
+    transactions = lambda: bus.transactions
+    speeds = [(80, 80), (-60, 40), (30, -90), (60, 60)]
+    messages = [json.dumps({'command': 'joystick', 'x': round(0.6 * math.sin(i / 20), 3), 'y': 0.8})
+                for i in range(200)]
+
+    def done(future):
+        if future is not None:
+            future.result()
+
+    def joystick(i):
+        data = json.loads(messages[i % len(messages)])
+        done(motor.drive(*joystick_to_duty(data.get('x', 0), data.get('y', 0), motor.speed, JOYSTICK_DEAD_ZONE)))
+
+    clock = f"{clock_hz // 1000} kHz" if clock_hz else "no wire time"
+    print(f"sim_smbus, {latency_us:g} us per transaction, {clock}, "
+          f"{'I2C worker' if use_worker else 'direct writes'}, {count} commands each")
+    measure_commands("drive", lambda i: done(motor.drive(*speeds[i % 4])), count, transactions)
+    measure_commands("stop", lambda i: done(motor.stop()), count, transactions,
+                     prepare=lambda i: done(motor.drive(*speeds[i % 4])))
+    measure_commands("joystick", joystick, count, transactions)
+    motor.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='benchmark', required=True)
+
+    bus = commands.add_parser('i2c', help="I2C transactions and bytes per motor command")
+    bus.add_argument('--repeat', type=int, default=1000, help="calls per command (default: 1000)")
+
+    queued = commands.add_parser('worker', help="drive() latency and bus traffic with the I2C worker")
+    queued.add_argument('--repeat', type=int, default=1000, help="drive() calls (default: 1000)")
+    queued.add_argument('--clock', type=int, default=100_000, help="simulated bus clock in Hz (default: 100000)")
+    queued.add_argument('--interval', type=float, default=0.2, help="ms between drive() calls (default: 0.2)")
+
+    commands_suite = commands.add_parser('suite', help="cmds/s, transactions and p50/p99 latency per command")
+    commands_suite.add_argument('--count', type=int, default=5000, help="commands per case (default: 5000)")
+    commands_suite.add_argument('--latency-us', type=float, default=0.0, help="simulated time per transaction")
+    commands_suite.add_argument('--clock', type=int, default=0, help="add wire time at this bus clock in Hz")
+    commands_suite.add_argument('--worker', action='store_true', help="go through the I2C worker")
+
+    args = parser.parse_args()
+    if args.benchmark == 'i2c':
+        i2c(args.repeat)
+    elif args.benchmark == 'worker':
+        worker(args.repeat, args.clock, args.interval / 1e3)
+    else:
+        suite(args.count, args.latency_us, args.clock, args.worker)
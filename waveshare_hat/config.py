@@ -1,4 +1,5 @@
 """Pin, I2C, and channel configuration for the Waveshare Motor Driver HAT"""
+import os
 
 # I2C
 I2C_BUS = 1
@@ -19,13 +20,41 @@ PWMB = 5  # Motor B speed (PWM)
 BIN1 = 3  # Motor B direction pin 1
 BIN2 = 4  # Motor B direction pin 2
 
-# --- Encoder GPIO pins (RESERVED — wired but NOT read by any code yet) ---
-# Quadrature decoding/RPM is out of scope here; deferred to a future sensors.py.
+# --- Encoder GPIO pins (read by sensors.py when SPEED_CONTROL is on) ---
 ENCODER_A_C1 = 5
 ENCODER_A_C2 = 6
 ENCODER_B_C1 = 12
 ENCODER_B_C2 = 16
 
+# GA12-N20 encoder geometry (UNVERIFIED — N20 encoders and gearboxes come in many variants;
+# check the motor's listing, or turn a wheel one full revolution and read the count)
+ENCODER_PPR = 7            # pulses per motor-shaft revolution, per channel
+ENCODER_GEAR_RATIO = 30    # motor-shaft revolutions per wheel revolution
+ENCODER_COUNTS_PER_REV = ENCODER_PPR * 4 * ENCODER_GEAR_RATIO  # x4 decoding, per wheel revolution
+
+# Closed-loop wheel speed (off by default: drive() is open-loop duty cycle)
+SPEED_CONTROL = False
+MAX_WHEEL_RPM = 300        # wheel RPM that drive(100, 100) asks for in speed control mode
+SPEED_SAMPLE_HZ = 50       # encoder sampling and PID update rate
+SPEED_KP = 0.2             # duty % per RPM of error
+SPEED_KI = 1.5             # duty % per RPM-second of accumulated error
+SPEED_KD = 0.0
+
 # Settings
 DEFAULT_SPEED = 80
 JOYSTICK_DEAD_ZONE = 0.05
+CONTROL_RATE_HZ = 50  # how often the newest motor setpoint is applied
+TELEMETRY_RATE_HZ = 5  # telemetry snapshots per second to subscribed clients
+I2C_WORKER = True     # write the PCA9685 from its own thread (see i2c_worker.py)
+
+# Simulated hardware for running and profiling off the car: CAR_SIMULATE=1 swaps in sim_smbus.py for smbus2
+# and the root sim_gpio.py for RPi.GPIO (wheel encoders, which then follow the motor duty).
+# CAR_SIM_LATENCY_US adds that many microseconds to every simulated I2C transaction.
+SIMULATE = os.environ.get('CAR_SIMULATE', '0') not in ('', '0')
+SIM_LATENCY_US = float(os.environ.get('CAR_SIM_LATENCY_US', '0'))
+
+# Startup: the motor diagnostic is skipped while config and driver code are unchanged since it
+# last passed (results cached in DIAGNOSTICS_CACHE); CAR_DIAGNOSE=1 runs it regardless.
+DIAGNOSTICS_CACHE = os.environ.get('CAR_DIAGNOSTICS_CACHE',
+                                   os.path.expanduser('~/.cache/car-project/diagnostics-waveshare.json'))
+FORCE_DIAGNOSE = os.environ.get('CAR_DIAGNOSE', '0') not in ('', '0')
@@ -0,0 +1,146 @@
+"""Dedicated thread for PCA9685 I2C traffic
+
+Callers queue writes and get a concurrent.futures.Future back (or await it
+from asyncio); only the worker thread ever touches the bus, so a slow or
+noisy bus delays the motors, never the caller.
+
+Queued channel writes are merged: a channel written again before the worker
+got to it is sent once, with the newest values, and everything pending goes
+out as one PCA9685.set_channels() call, whose Future every write merged
+into it shares — so the queue never holds more than the 16 channels and a
+few calls, however fast writes arrive. Urgent writes (stop) and all_off()
+(emergency stop) replace whatever channel writes are still pending and run
+before anything else. An urgent write never replaces a pending all_off(): it
+runs after it.
+"""
+import asyncio
+import collections
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+log = logging.getLogger(__name__)
+
+MAX_CALLS = 32  # other queued operations (reset, set_pwm_freq, ...) before call() refuses more
+
+
+class I2CWorker:
+    def __init__(self, pca, max_calls=MAX_CALLS):
+        self.pca = pca
+        self._max_calls = max_calls
+        self._cond = threading.Condition()
+        self._urgent = []          # (function, args, future) jobs run before anything else
+        self._calls = collections.deque()
+        self._channels = {}        # channel -> registers, newest wins
+        self._batch = None         # Future shared by the pending channel writes
+        self._closed = False
+        self.batches = 0           # set_channels() calls made for queued writes
+        self.coalesced = 0         # channel updates overwritten before they were sent
+        self.superseded = 0        # pending batches dropped for an urgent write
+        self._thread = threading.Thread(target=self._run, name='i2c-worker', daemon=True)
+        self._thread.start()
+
+    def write(self, channels, urgent=False):
+        """Queue register values per channel (see PCA9685.set_channels); returns a Future.
+
+        Raises RuntimeError once the worker is closed, as do all_off() and call().
+        """
+        with self._cond:
+            self._check_open()
+            if urgent:
+                self._supersede(keep_all_off=True)
+                future = Future()
+                self._urgent.append((self.pca.set_channels, (dict(channels),), future))
+            else:
+                if self._batch is None:
+                    self._batch = Future()
+                self.coalesced += len(self._channels.keys() & channels.keys())
+                self._channels.update(channels)
+                future = self._batch
+            self._cond.notify()
+        return future
+
+    def all_off(self):
+        """Emergency stop ahead of everything queued; returns a Future."""
+        future = Future()
+        with self._cond:
+            self._check_open()
+            self._supersede()
+            self._urgent.append((self.pca.all_off, (), future))
+            self._cond.notify()
+        return future
+
+    def call(self, function, *args):
+        """Run function(*args) on the worker thread, e.g. pca.reset; returns a Future.
+
+        Raises queue.Full if MAX_CALLS calls are already waiting.
+        """
+        future = Future()
+        with self._cond:
+            self._check_open()
+            if len(self._calls) >= self._max_calls:
+                raise queue.Full(f"{len(self._calls)} I2C calls already queued")
+            self._calls.append((function, args, future))
+            self._cond.notify()
+        return future
+
+    async def write_async(self, channels, urgent=False):
+        return await asyncio.wrap_future(self.write(channels, urgent))
+
+    async def all_off_async(self):
+        return await asyncio.wrap_future(self.all_off())
+
+    async def call_async(self, function, *args):
+        return await asyncio.wrap_future(self.call(function, *args))
+
+    def close(self):
+        """Finish what is queued, then stop the thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def stats(self):
+        return {'batches': self.batches, 'coalesced': self.coalesced, 'superseded': self.superseded}
+
+    def _check_open(self):
+        """Caller holds _cond. Nothing queued after close() would ever run, leaving its Future unresolved."""
+        if self._closed:
+            raise RuntimeError("I2C worker is closed")
+
+    def _supersede(self, keep_all_off=False):
+        """Drop pending channel writes, their Futures resolving to False. Caller holds _cond.
+
+        A pending all_off() is dropped too unless keep_all_off: its Future
+        must not report the outputs off when its write never happened.
+        """
+        kept = [job for job in self._urgent if keep_all_off and job[0] == self.pca.all_off]
+        dropped = [job[2] for job in self._urgent if job not in kept]
+        for future in [self._batch] + dropped:
+            if future is not None:
+                self.superseded += 1
+                future.set_result(False)
+        self._channels, self._batch, self._urgent = {}, None, kept
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._urgent or self._calls or self._channels or self._closed)
+                jobs = list(self._urgent)
+                jobs.extend(self._calls)
+                if self._channels:
+                    jobs.append((self.pca.set_channels, (self._channels,), self._batch))
+                    self.batches += 1
+                if not jobs and self._closed:
+                    return
+                self._urgent, self._calls, self._channels, self._batch = [], collections.deque(), {}, None
+
+            for function, args, future in jobs:
+                try:
+                    function(*args)
+                except Exception as e:
+                    log.exception("I2C operation %s failed", getattr(function, '__name__', function))
+                    future.set_exception(e)
+                else:
+                    future.set_result(True)
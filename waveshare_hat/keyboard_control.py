@@ -1,16 +1,15 @@
 """Keyboard control interface"""
 import logging
+import os
 import sys
 import tty
 import termios
 import time
 from motor_controller import MotorController
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))  # root utils.py
+from utils import setup_logging
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    datefmt="%H:%M:%S",
-)
+setup_logging(logging.DEBUG)
 log = logging.getLogger(__name__)
 
 def get_key():
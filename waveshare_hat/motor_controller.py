@@ -1,25 +1,71 @@
 """Core motor control functionality for the Waveshare Motor Driver HAT (PCA9685 + TB6612FNG)"""
+import asyncio
 import logging
+import threading
 import time
 
 from config import *
-from pca9685 import PCA9685
+from i2c_worker import I2CWorker
+from pca9685 import PCA9685, digital_registers, duty_registers
 
 log = logging.getLogger(__name__)
 
 
+class PID:
+    """PID controller with a clamped output; the integral stops growing while the output is saturated."""
+
+    def __init__(self, kp, ki, kd, limit=100.0):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.limit = limit
+        self.reset()
+
+    def reset(self):
+        self._integral = 0.0
+        self._previous = None
+
+    def update(self, error, dt):
+        derivative = 0.0 if self._previous is None or dt <= 0 else (error - self._previous) / dt
+        self._previous = error
+        integral = self._integral + error * dt
+        output = self.kp * error + self.ki * integral + self.kd * derivative
+        if -self.limit < output < self.limit:
+            self._integral = integral
+        return max(-self.limit, min(self.limit, output))
+
+
 class MotorController:
-    def __init__(self):
+    """Motor commands for the HAT.
+
+    With i2c_worker (the default, see I2C_WORKER) the PCA9685 is only
+    written from an I2CWorker thread: commands queue their writes and return
+    a concurrent.futures.Future at once instead of waiting for the bus, and
+    the *_async methods await that write from asyncio. Without it, commands
+    write the bus themselves and return None.
+    """
+
+    def __init__(self, pca=None, speed_control=SPEED_CONTROL, i2c_worker=I2C_WORKER):
         self.speed = DEFAULT_SPEED
-        self.pca = None
+        self.pca = pca
+        self.worker = None
+        self.sampler = None
+        self._wheels = ()  # simulated wheels turning the encoders under CAR_SIMULATE
+        # drive() and the speed regulator write the PCA9685 from different threads
+        self._lock = threading.Lock()
+        self._target_rpm = (0.0, 0.0)
+        self._corrections = [0.0, 0.0]
+        self._pids = (PID(SPEED_KP, SPEED_KI, SPEED_KD), PID(SPEED_KP, SPEED_KI, SPEED_KD))
         self.setup()
+        if i2c_worker:
+            self.worker = I2CWorker(self.pca)
+        if speed_control:
+            self.enable_speed_control()
 
     def setup(self):
-        self.pca = PCA9685()
-        for channel in (AIN1, AIN2, BIN1, BIN2):
-            self.pca.set_digital(channel, False)
-        self.pca.set_duty_cycle(PWMA, 0)
-        self.pca.set_duty_cycle(PWMB, 0)
+        if self.pca is None:
+            self.pca = PCA9685()
+        self.pca.set_channels(self._channels(0, 0))
         log.info(
             "PCA9685 setup complete — Motor A: PWMA=%d AIN1=%d AIN2=%d, "
             "Motor B: PWMB=%d BIN1=%d BIN2=%d",
@@ -31,14 +77,93 @@ class MotorController:
             "see README 'Troubleshooting' if the wrong motor (or no motor) responds"
         )
 
+    def enable_speed_control(self, gpio=None):
+        """Hold wheel speed with the encoders: drive() duties become a fraction of MAX_WHEEL_RPM.
+
+        Each wheel's duty is its feed-forward (target / MAX_WHEEL_RPM) plus a
+        PID correction updated SPEED_SAMPLE_HZ times a second from the
+        measured RPM, so the car keeps its speed as the battery drains and
+        both wheels turn at the speed asked for. With CAR_SIMULATE the
+        encoders read simulated wheels that turn as fast as their duty says.
+        """
+        from sensors import EdgeGenerator, QuadratureEncoder, RPMSampler
+
+        pins = ((ENCODER_A_C1, ENCODER_A_C2), (ENCODER_B_C1, ENCODER_B_C2))
+        encoders = [QuadratureEncoder(a, b, ENCODER_COUNTS_PER_REV, gpio=gpio) for a, b in pins]
+        self.sampler = RPMSampler(encoders, SPEED_SAMPLE_HZ, on_sample=self._regulate)
+        self.sampler.start()
+        if SIMULATE and gpio is None:
+            import sim_gpio
+            self._wheels = [EdgeGenerator(sim_gpio, a, b, ENCODER_COUNTS_PER_REV) for a, b in pins]
+            for wheel in self._wheels:
+                wheel.start()
+        log.info("Speed control on: %d counts/rev, %d Hz, max %d RPM",
+                 ENCODER_COUNTS_PER_REV, SPEED_SAMPLE_HZ, MAX_WHEEL_RPM)
+
+    @property
+    def wheel_rpm(self):
+        """Measured (left, right) wheel RPM, or None without speed control."""
+        return tuple(self.sampler.rpm) if self.sampler else None
+
+    def _set(self, left_duty, right_duty):
+        with self._lock:
+            if self.sampler is not None:
+                targets = (left_duty / 100 * MAX_WHEEL_RPM, right_duty / 100 * MAX_WHEEL_RPM)
+                for i, (target, previous) in enumerate(zip(targets, self._target_rpm)):
+                    if target == 0 or (target > 0) != (previous > 0):
+                        self._pids[i].reset()  # stopped or reversed: start over
+                        self._corrections[i] = 0.0
+                self._target_rpm = targets
+                # Feed-forward plus the current correction now; the regulator refines it
+                left_duty = max(-100.0, min(100.0, left_duty + self._corrections[0])) if left_duty else 0
+                right_duty = max(-100.0, min(100.0, right_duty + self._corrections[1])) if right_duty else 0
+            # A stop overtakes any drive still waiting for the bus
+            return self._write(self._channels(left_duty, right_duty), urgent=not (left_duty or right_duty))
+
+    def _regulate(self, rpms, dt):
+        with self._lock:
+            duties = []
+            for i, (target, rpm) in enumerate(zip(self._target_rpm, rpms)):
+                if target == 0:
+                    duties.append(0)
+                    continue
+                self._corrections[i] = self._pids[i].update(target - rpm, dt)
+                duties.append(max(-100.0, min(100.0, target / MAX_WHEEL_RPM * 100 + self._corrections[i])))
+            if any(duties):
+                self._write(self._channels(*duties))
+
+    def _write(self, channels, urgent=False):
+        """Send register values through the worker (returning its Future) or straight to the bus."""
+        if self.worker is not None:
+            return self.worker.write(channels, urgent)
+        self.pca.set_channels(channels)
+        return None
+
+    @staticmethod
+    async def _wait(future):
+        if future is not None:
+            await asyncio.wrap_future(future)
+
+    @staticmethod
+    def _motor_channels(in1_ch, in2_ch, pwm_ch, duty):
+        """Register values for one motor; the sign of duty picks the direction, 0 leaves both pins low like stop()."""
+        return {
+            in1_ch: digital_registers(duty > 0),
+            in2_ch: digital_registers(duty < 0),
+            pwm_ch: duty_registers(abs(duty)),
+        }
+
+    def _channels(self, left_duty, right_duty):
+        for wheel, duty in zip(self._wheels, (left_duty, right_duty)):
+            wheel.rpm = duty / 100 * MAX_WHEEL_RPM
+        channels = self._motor_channels(AIN1, AIN2, PWMA, left_duty)
+        channels.update(self._motor_channels(BIN1, BIN2, PWMB, right_duty))
+        return channels
+
     def _drive_channels(self, in1_ch, in2_ch, pwm_ch, duty, forward=True):
-        if forward:
-            self.pca.set_digital(in1_ch, True)
-            self.pca.set_digital(in2_ch, False)
-        else:
-            self.pca.set_digital(in1_ch, False)
-            self.pca.set_digital(in2_ch, True)
-        self.pca.set_duty_cycle(pwm_ch, abs(duty))
+        duty = abs(duty) if forward else -abs(duty)
+        with self._lock:
+            return self._write(self._motor_channels(in1_ch, in2_ch, pwm_ch, duty))
 
     def diagnose(self, pulse_duration=1.0, duty_cycle=35):
         """Pulse each motor briefly so the human can visually confirm it spins.
@@ -55,8 +180,7 @@ class MotorController:
         log.info("Testing Motor A (PWMA=%d, AIN1=%d, AIN2=%d) — should spin forward briefly", PWMA, AIN1, AIN2)
         self._drive_channels(AIN1, AIN2, PWMA, duty_cycle, forward=True)
         time.sleep(pulse_duration)
-        self.pca.set_duty_cycle(PWMA, 0)
-        self.pca.set_digital(AIN1, False)
+        self._drive_channels(AIN1, AIN2, PWMA, 0)
         results['motor_a'] = 'pulsed — confirm visually'
 
         time.sleep(0.2)
@@ -64,8 +188,7 @@ class MotorController:
         log.info("Testing Motor B (PWMB=%d, BIN1=%d, BIN2=%d) — should spin forward briefly", PWMB, BIN1, BIN2)
         self._drive_channels(BIN1, BIN2, PWMB, duty_cycle, forward=True)
         time.sleep(pulse_duration)
-        self.pca.set_duty_cycle(PWMB, 0)
-        self.pca.set_digital(BIN1, False)
+        self._drive_channels(BIN1, BIN2, PWMB, 0)
         results['motor_b'] = 'pulsed — confirm visually'
 
         results['note'] = 'no electrical readback available'
@@ -75,30 +198,33 @@ class MotorController:
 
     def forward(self):
         log.debug("forward — speed=%d%%", self.speed)
-        self._drive_channels(AIN1, AIN2, PWMA, self.speed, forward=True)
-        self._drive_channels(BIN1, BIN2, PWMB, self.speed, forward=True)
+        return self._set(self.speed, self.speed)
 
     def backward(self):
         log.debug("backward — speed=%d%%", self.speed)
-        self._drive_channels(AIN1, AIN2, PWMA, self.speed, forward=False)
-        self._drive_channels(BIN1, BIN2, PWMB, self.speed, forward=False)
+        return self._set(-self.speed, -self.speed)
 
     def left(self):
         log.debug("left — speed=%d%%", self.speed)
-        self._drive_channels(AIN1, AIN2, PWMA, self.speed, forward=False)
-        self._drive_channels(BIN1, BIN2, PWMB, self.speed, forward=True)
+        return self._set(-self.speed, self.speed)
 
     def right(self):
         log.debug("right — speed=%d%%", self.speed)
-        self._drive_channels(AIN1, AIN2, PWMA, self.speed, forward=True)
-        self._drive_channels(BIN1, BIN2, PWMB, self.speed, forward=False)
+        return self._set(self.speed, -self.speed)
 
     def stop(self):
         log.debug("stop")
-        self.pca.set_duty_cycle(PWMA, 0)
-        self.pca.set_duty_cycle(PWMB, 0)
-        for channel in (AIN1, AIN2, BIN1, BIN2):
-            self.pca.set_digital(channel, False)
+        return self._set(0, 0)
+
+    def emergency_stop(self):
+        """Cut every PCA9685 output with a single write, whatever state the driver thinks it is in."""
+        log.info("emergency stop")
+        with self._lock:
+            self._target_rpm = (0.0, 0.0)  # keep the speed regulator from driving again
+            if self.worker is not None:
+                return self.worker.all_off()
+            self.pca.all_off()
+            return None
 
     def set_speed(self, speed):
         self.speed = max(0, min(100, speed))
@@ -123,10 +249,25 @@ class MotorController:
         left_speed = max(-100, min(100, left_speed))
         right_speed = max(-100, min(100, right_speed))
 
-        self._drive_channels(AIN1, AIN2, PWMA, left_speed, forward=left_speed >= 0)
-        self._drive_channels(BIN1, BIN2, PWMB, right_speed, forward=right_speed >= 0)
+        return self._set(left_speed, right_speed)
+
+    async def drive_async(self, left_speed, right_speed):
+        """drive(), returning once the new duties are on the bus."""
+        await self._wait(self.drive(left_speed, right_speed))
+
+    async def stop_async(self):
+        await self._wait(self.stop())
+
+    async def emergency_stop_async(self):
+        await self._wait(self.emergency_stop())
 
     def cleanup(self):
         log.info("Cleaning up PCA9685")
-        self.stop()
+        if self.sampler is not None:
+            self.sampler.close()
+        for wheel in self._wheels:
+            wheel.close()
+        self.emergency_stop()
+        if self.worker is not None:
+            self.worker.close()
         self.pca.close()
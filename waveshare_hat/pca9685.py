@@ -2,7 +2,10 @@
 import logging
 import time
 
-from smbus2 import SMBus
+try:
+    from smbus2 import SMBus
+except ImportError:  # only the simulated bus is available (CAR_SIMULATE)
+    SMBus = None
 
 log = logging.getLogger(__name__)
 
@@ -11,6 +14,7 @@ MODE1 = 0x00
 MODE2 = 0x01
 PRESCALE = 0xFE
 LED0_ON_L = 0x06  # channel n's 4 registers start at LED0_ON_L + 4*n
+ALL_LED_OFF_H = 0xFD  # written to every channel's LEDn_OFF_H at once
 
 # MODE1 bits
 SLEEP = 0x10
@@ -22,21 +26,83 @@ FULL_BIT = 0x10
 
 OSCILLATOR_HZ = 25_000_000
 
+CHANNELS = 16
+MAX_BLOCK_BYTES = 32  # SMBus block write limit, i.e. 8 channels per transaction
+SPAN_GAP_BYTES = 4    # unchanged registers worth rewriting to save starting another transaction
+
+
+def pwm_registers(on, off):
+    """LEDn_ON_L, LEDn_ON_H, LEDn_OFF_L, LEDn_OFF_H for a PWM window."""
+    return (on & 0xFF, (on >> 8) & 0xFF, off & 0xFF, (off >> 8) & 0xFF)
+
+
+FULL_ON = (0, FULL_BIT, 0, 0)
+FULL_OFF = (0, 0, 0, FULL_BIT)
+
+
+def digital_registers(level):
+    return FULL_ON if level else FULL_OFF
+
+
+def duty_registers(percent):
+    percent = max(0, min(100, percent))
+    if percent == 0:
+        return FULL_OFF
+    if percent == 100:
+        return FULL_ON
+    return pwm_registers(0, int(4095 * percent / 100))
+
 
 class PCA9685:
+    """PCA9685 on an I2C bus.
+
+    `bus` is a bus number, or an already open SMBus-like object (anything with
+    the smbus2 read/write methods used here, e.g. a fake for benchmarks).
+    """
+
     def __init__(self, bus=None, address=None):
-        from config import I2C_BUS, PCA9685_ADDRESS, PWM_FREQUENCY
+        from config import I2C_BUS, PCA9685_ADDRESS, PWM_FREQUENCY, SIMULATE, SIM_LATENCY_US
 
         self.address = address if address is not None else PCA9685_ADDRESS
-        self.bus = SMBus(bus if bus is not None else I2C_BUS)
+        if bus is None or isinstance(bus, int):
+            bus = bus if bus is not None else I2C_BUS
+            if SIMULATE:
+                from sim_smbus import SMBus as SimSMBus
+                bus = SimSMBus(bus, latency=SIM_LATENCY_US / 1e6)
+                log.info("Simulated I2C bus (CAR_SIMULATE), %g us per transaction", SIM_LATENCY_US)
+            elif SMBus is None:
+                raise RuntimeError("smbus2 is required to talk to the PCA9685 (CAR_SIMULATE=1 simulates it)")
+            else:
+                bus = SMBus(bus)
+        self.bus = bus
+        # Shadow copy of the LEDn_* registers (None = unknown), 4 per channel
+        self._shadow = [None] * (4 * CHANNELS)
+        self.writes_issued = 0   # block writes sent to the chip
+        self.writes_skipped = 0  # updates that matched the shadow and needed no write
         self.reset()
         self.set_pwm_freq(PWM_FREQUENCY)
         log.info("PCA9685 initialized at address 0x%02X", self.address)
 
     def reset(self):
         self.bus.write_byte_data(self.address, MODE1, 0x00)
+        self.invalidate()
         time.sleep(0.005)
 
+    def invalidate(self):
+        """Forget the shadow registers, so the next update of each channel is written in full.
+
+        Call after anything that may change the channel registers behind the
+        driver's back (reset, another process, a brown-out).
+        """
+        self._shadow = [None] * (4 * CHANNELS)
+
+    def resync(self):
+        """Reload the shadow registers from the chip."""
+        shadow = []
+        for offset in range(0, 4 * CHANNELS, MAX_BLOCK_BYTES):
+            shadow.extend(self.bus.read_i2c_block_data(self.address, LED0_ON_L + offset, MAX_BLOCK_BYTES))
+        self._shadow = shadow
+
     def set_pwm_freq(self, freq_hz):
         prescale = round(OSCILLATOR_HZ / (4096 * freq_hz)) - 1
         old_mode = self.bus.read_byte_data(self.address, MODE1)
@@ -49,19 +115,13 @@ class PCA9685:
         log.info("PWM frequency set: %d Hz (prescale=%d)", freq_hz, prescale)
 
     def set_pwm(self, channel, on, off):
-        base = LED0_ON_L + 4 * channel
-        self.bus.write_i2c_block_data(self.address, base, [
-            on & 0xFF, (on >> 8) & 0xFF,
-            off & 0xFF, (off >> 8) & 0xFF,
-        ])
+        self.set_channels({channel: pwm_registers(on, off)})
 
     def set_full_on(self, channel):
-        base = LED0_ON_L + 4 * channel
-        self.bus.write_i2c_block_data(self.address, base, [0, FULL_BIT, 0, 0])
+        self.set_channels({channel: FULL_ON})
 
     def set_full_off(self, channel):
-        base = LED0_ON_L + 4 * channel
-        self.bus.write_i2c_block_data(self.address, base, [0, 0, 0, FULL_BIT])
+        self.set_channels({channel: FULL_OFF})
 
     def set_digital(self, channel, level):
         if level:
@@ -70,13 +130,60 @@ class PCA9685:
             self.set_full_off(channel)
 
     def set_duty_cycle(self, channel, percent):
-        percent = max(0, min(100, percent))
-        if percent == 0:
-            self.set_full_off(channel)
-        elif percent == 100:
-            self.set_full_on(channel)
-        else:
-            self.set_pwm(channel, 0, int(4095 * percent / 100))
+        self.set_channels({channel: duty_registers(percent)})
+
+    def set_channels(self, channels):
+        """Update several channels, writing only the registers that differ from the shadow.
+
+        `channels` maps channel number to its 4 register values (see
+        duty_registers / digital_registers). Changed registers are sent in as
+        few auto-increment block writes as possible: unchanged registers of
+        up to SPAN_GAP_BYTES between two changed ones are rewritten from the
+        shadow to keep one block going, and a block is split where a gap is
+        longer, holds an unknown register, or would exceed MAX_BLOCK_BYTES.
+        """
+        shadow = self._shadow
+        changed = {}
+        for channel, registers in channels.items():
+            base = 4 * channel
+            for i, value in enumerate(registers):
+                if shadow[base + i] != value:
+                    changed[base + i] = value
+        if not changed:
+            self.writes_skipped += 1
+            return
+
+        spans = []
+        for offset in sorted(changed):
+            if spans:
+                first, values = spans[-1]
+                gap = range(first + len(values), offset)
+                if (len(gap) <= SPAN_GAP_BYTES and len(values) + len(gap) < MAX_BLOCK_BYTES
+                        and all(shadow[i] is not None for i in gap)):
+                    values.extend(shadow[i] for i in gap)
+                    values.append(changed[offset])
+                    continue
+            spans.append((offset, [changed[offset]]))
+
+        for first, values in spans:
+            self.bus.write_i2c_block_data(self.address, LED0_ON_L + first, values)
+            shadow[first:first + len(values)] = values
+        self.writes_issued += len(spans)
+
+    def all_off(self):
+        """Emergency stop: one single-byte write sets the full-off bit of every channel.
+
+        Full-off takes precedence over full-on and PWM, so every output goes
+        low whatever it was doing. Always sent, whatever the shadow says.
+        """
+        self.bus.write_byte_data(self.address, ALL_LED_OFF_H, FULL_BIT)
+        self.writes_issued += 1
+        # Every LEDn_OFF_H now holds exactly FULL_BIT
+        for channel in range(CHANNELS):
+            self._shadow[4 * channel + 3] = FULL_BIT
+
+    def stats(self):
+        return {'writes_issued': self.writes_issued, 'writes_skipped': self.writes_skipped}
 
     def close(self):
         self.bus.close()
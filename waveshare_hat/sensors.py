@@ -0,0 +1,292 @@
+"""Quadrature wheel encoders for the GA12-N20 motors
+
+Each encoder's C1/C2 outputs are watched with RPi.GPIO edge callbacks. A
+callback only stores the new 2-bit pin state in a preallocated ring buffer;
+decoding happens later, when RPMSampler drains the ring at a fixed rate and
+turns the counts into wheel RPM.
+
+With CAR_SIMULATE=1 the pins are the root sim_gpio.py's. Without the car,
+run the simulated edge generator:
+
+    cd waveshare_hat
+    python3 sensors.py encoder        # counting accuracy and edge rate headroom
+    python3 sensors.py pid            # closed-loop speed hold while the battery sags
+"""
+import argparse
+import array
+import logging
+import os
+import sys
+import threading
+import time
+
+from config import SIMULATE
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))  # root sim_gpio.py
+import sim_gpio
+
+if SIMULATE:
+    GPIO = sim_gpio
+else:
+    try:
+        import RPi.GPIO as GPIO
+    except ImportError:
+        GPIO = None
+
+log = logging.getLogger(__name__)
+
+RING_SIZE = 4096  # edges buffered between two samples; must be a power of two
+
+# Count change for (previous state << 2 | new state), states being (C1 << 1 | C2).
+# Forward runs 00 -> 01 -> 11 -> 10; None marks a jump of two steps (an edge was missed).
+TRANSITIONS = (
+    0, +1, -1, None,
+    -1, 0, None, +1,
+    +1, None, 0, -1,
+    None, -1, +1, 0,
+)
+
+
+class QuadratureEncoder:
+    """Counts x4-decoded quadrature edges on two GPIO pins.
+
+    The edge callback runs on RPi.GPIO's callback thread and does no more
+    than read both pins into the ring; poll() is called from one other
+    thread and decodes whatever has arrived since the last call. A jump of
+    two steps (a missed edge) is counted in `errors` and assumed to continue
+    in the last direction seen.
+    """
+
+    def __init__(self, pin_a, pin_b, counts_per_rev, gpio=None, ring_size=RING_SIZE):
+        self.pin_a = pin_a
+        self.pin_b = pin_b
+        self.counts_per_rev = counts_per_rev
+        self.position = 0
+        self.errors = 0
+        self.overflows = 0
+        self._gpio = gpio or GPIO
+        if self._gpio is None:
+            raise RuntimeError("RPi.GPIO is required to read the wheel encoders (CAR_SIMULATE=1 simulates them)")
+        self._ring = array.array('B', bytes(ring_size))
+        self._mask = ring_size - 1
+        self._head = 0  # written only by the edge callback
+        self._tail = 0  # written only by poll()
+        self._state = 0
+        self._direction = 1
+
+    def start(self):
+        gpio = self._gpio
+        gpio.setmode(gpio.BCM)
+        gpio.setup([self.pin_a, self.pin_b], gpio.IN, pull_up_down=gpio.PUD_UP)
+        self._state = self._read()
+        for pin in (self.pin_a, self.pin_b):
+            gpio.add_event_detect(pin, gpio.BOTH, callback=self._edge)
+
+    def close(self):
+        for pin in (self.pin_a, self.pin_b):
+            self._gpio.remove_event_detect(pin)
+
+    def _read(self):
+        return (self._gpio.input(self.pin_a) << 1) | self._gpio.input(self.pin_b)
+
+    def _edge(self, channel):
+        head = self._head
+        self._ring[head & self._mask] = (self._gpio.input(self.pin_a) << 1) | self._gpio.input(self.pin_b)
+        self._head = head + 1
+
+    def poll(self):
+        """Decode the edges buffered since the last poll and return the position in counts."""
+        head, tail = self._head, self._tail
+        if head - tail > len(self._ring):
+            self.overflows += head - tail - len(self._ring)
+            tail = head - len(self._ring)
+
+        ring, mask = self._ring, self._mask
+        state, position, direction = self._state, self.position, self._direction
+        for i in range(tail, head):
+            new = ring[i & mask]
+            delta = TRANSITIONS[(state << 2) | new]
+            if delta is None:
+                self.errors += 1
+                delta = 2 * direction
+            elif delta:
+                direction = delta
+            position += delta
+            state = new
+
+        self._state, self.position, self._direction = state, position, direction
+        self._tail = head
+        return position
+
+
+class RPMSampler:
+    """Thread that polls encoders at a fixed rate and keeps their signed RPM.
+
+    on_sample(rpms, dt), if given, is called on the sampler thread after
+    every sample — MotorController's speed control runs there.
+    """
+
+    def __init__(self, encoders, rate_hz, on_sample=None):
+        self.encoders = encoders
+        self.period = 1.0 / rate_hz
+        self.on_sample = on_sample
+        self.rpm = [0.0] * len(encoders)
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        for encoder in self.encoders:
+            encoder.start()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='rpm-sampler', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for encoder in self.encoders:
+            encoder.close()
+
+    def _run(self):
+        positions = [encoder.poll() for encoder in self.encoders]
+        last = time.monotonic()
+        next_tick = last + self.period
+
+        while self._running:
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+            next_tick += self.period
+            now = time.monotonic()
+            dt, last = now - last, now
+
+            for i, encoder in enumerate(self.encoders):
+                position = encoder.poll()
+                self.rpm[i] = (position - positions[i]) / encoder.counts_per_rev / dt * 60
+                positions[i] = position
+            if self.on_sample is not None:
+                try:
+                    self.on_sample(self.rpm, dt)
+                except Exception:
+                    log.exception("Speed sample handler failed")
+
+
+class EdgeGenerator:
+    """Drives a sim_gpio pin pair like a wheel turning at `rpm` (signed; settable at any time)."""
+
+    SEQUENCE = (0b00, 0b01, 0b11, 0b10)
+
+    def __init__(self, gpio, pin_a, pin_b, counts_per_rev, rpm=0.0):
+        self.gpio = gpio
+        self.pin_a = pin_a
+        self.pin_b = pin_b
+        self.counts_per_rev = counts_per_rev
+        self.rpm = rpm
+        self.position = 0  # edges actually generated
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='edge-generator', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+
+    def step(self, direction):
+        self.position += direction
+        state = self.SEQUENCE[self.position % 4]
+        self.gpio.set_input(self.pin_a, state >> 1)
+        self.gpio.set_input(self.pin_b, state & 1)
+
+    def _run(self):
+        due = 0.0
+        last = time.monotonic()
+        while self._running:
+            time.sleep(0.0005)
+            now = time.monotonic()
+            due += self.rpm / 60 * self.counts_per_rev * (now - last)
+            last = now
+            while due >= 1:
+                self.step(1)
+                due -= 1
+            while due <= -1:
+                self.step(-1)
+                due += 1
+
+
+def _simulated(counts_per_rev, rate_hz, on_sample=None):
+    encoder = QuadratureEncoder(5, 6, counts_per_rev, gpio=sim_gpio)
+    generator = EdgeGenerator(sim_gpio, 5, 6, counts_per_rev)
+    sampler = RPMSampler([encoder], rate_hz, on_sample)
+    return encoder, generator, sampler
+
+
+def _encoder_check(counts_per_rev, rate_hz, max_rpm):
+    encoder, generator, sampler = _simulated(counts_per_rev, rate_hz)
+    sampler.start()
+    generator.start()
+    for rpm in (60, 300, -150, 0):
+        generator.rpm = rpm
+        time.sleep(1.0)
+        print(f"wheel {rpm:>5} RPM  measured {sampler.rpm[0]:>7.1f} RPM  "
+              f"position {encoder.poll():>6} / generated {generator.position:>6}  errors {encoder.errors}")
+    generator.close()
+    sampler.close()
+
+    # How fast can edges come? The callback's cost bounds what RPi.GPIO's callback
+    # thread keeps up with, and the ring must hold everything between two samples.
+    encoder = QuadratureEncoder(5, 6, counts_per_rev, gpio=generator.gpio)
+    count = 100_000
+    started = time.perf_counter()
+    for _ in range(count):
+        encoder._edge(5)
+    callback_rate = count / (time.perf_counter() - started)
+    needed = max_rpm / 60 * counts_per_rev * 2
+    print(f"edge callback: {callback_rate:,.0f} edges/s; ring holds {len(encoder._ring) * rate_hz:,.0f} edges/s "
+          f"at {rate_hz} Hz sampling; both wheels at {max_rpm} RPM need {needed:,.0f} edges/s")
+
+
+def _pid_check(counts_per_rev, rate_hz, max_rpm):
+    from motor_controller import PID
+    from config import SPEED_KP, SPEED_KI, SPEED_KD
+
+    target = max_rpm * 0.6
+    duty = [0.0]
+    pid = PID(SPEED_KP, SPEED_KI, SPEED_KD)
+
+    def regulate(rpms, dt):
+        feed_forward = target / max_rpm * 100
+        duty[0] = max(-100.0, min(100.0, feed_forward + pid.update(target - rpms[0], dt)))
+
+    encoder, generator, sampler = _simulated(counts_per_rev, rate_hz, regulate)
+    sampler.start()
+    generator.start()
+    started = time.monotonic()
+    next_report = started
+    while time.monotonic() - started < 6:
+        # Wheel: first-order response to duty; the battery sags from 100% to 70%
+        now = time.monotonic()
+        battery = 1.0 - 0.3 * min(1.0, (now - started) / 4)
+        generator.rpm += (duty[0] / 100 * max_rpm * battery - generator.rpm) * 0.1
+        if now >= next_report:
+            next_report += 0.5
+            print(f"t={now - started:4.1f}s battery {battery:.0%}  target {target:.0f}  "
+                  f"measured {sampler.rpm[0]:6.1f} RPM  duty {duty[0]:5.1f}%")
+        time.sleep(0.01)
+    generator.close()
+    sampler.close()
+
+
+if __name__ == "__main__":
+    from config import ENCODER_COUNTS_PER_REV, MAX_WHEEL_RPM, SPEED_SAMPLE_HZ
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('check', choices=('encoder', 'pid'))
+    args = parser.parse_args()
+    if args.check == 'encoder':
+        _encoder_check(ENCODER_COUNTS_PER_REV, SPEED_SAMPLE_HZ, MAX_WHEEL_RPM)
+    else:
+        _pid_check(ENCODER_COUNTS_PER_REV, SPEED_SAMPLE_HZ, MAX_WHEEL_RPM)
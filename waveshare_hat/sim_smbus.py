@@ -0,0 +1,63 @@
+"""Simulated smbus2.SMBus for running the HAT's PCA9685 driver off the car
+
+Keeps a 256-byte register file per device address (block writes
+auto-increment, as with MODE1's AI bit set), so reads return what was
+written. Every transaction is recorded in `calls` as
+(time.perf_counter(), method, address, register, data) and counted in
+`transactions` and `bytes`. Each transaction can take `latency` seconds plus,
+with `clock_hz`, its time on the wire.
+
+Selected with CAR_SIMULATE=1 (see config.py); CAR_SIM_LATENCY_US sets
+`latency`.
+"""
+import collections
+import time
+
+CALL_LOG_SIZE = 100_000  # most recent transactions kept in `calls`
+
+
+def wire_time(nbytes, clock_hz):
+    """Seconds on the wire: 9 clocks per byte (8 bits + ACK) plus a start and stop."""
+    return (nbytes * 9 + 2) / clock_hz
+
+
+class SMBus:
+    def __init__(self, bus=None, latency=0.0, clock_hz=None, log_size=CALL_LOG_SIZE):
+        self.bus = bus
+        self.latency = latency
+        self.clock_hz = clock_hz
+        self.registers = collections.defaultdict(lambda: bytearray(256))
+        self.calls = collections.deque(maxlen=log_size)
+        self.transactions = 0
+        self.bytes = 0  # on the wire: address and register bytes included
+
+    def _record(self, method, address, register, data, data_bytes):
+        self.transactions += 1
+        self.bytes += 2 + data_bytes
+        self.calls.append((time.perf_counter(), method, address, register, data))
+        delay = self.latency
+        if self.clock_hz:
+            delay += wire_time(2 + data_bytes, self.clock_hz)
+        if delay:
+            time.sleep(delay)
+
+    def write_byte_data(self, address, register, value):
+        self._record('write_byte_data', address, register, value, 1)
+        self.registers[address][register] = value & 0xFF
+
+    def read_byte_data(self, address, register):
+        self._record('read_byte_data', address, register, None, 1)
+        return self.registers[address][register]
+
+    def write_i2c_block_data(self, address, register, data):
+        self._record('write_i2c_block_data', address, register, list(data), len(data))
+        for offset, value in enumerate(data):
+            self.registers[address][(register + offset) & 0xFF] = value & 0xFF
+
+    def read_i2c_block_data(self, address, register, length):
+        self._record('read_i2c_block_data', address, register, length, length)
+        registers = self.registers[address]
+        return [registers[(register + offset) & 0xFF] for offset in range(length)]
+
+    def close(self):
+        pass